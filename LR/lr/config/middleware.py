@@ -1,4 +1,7 @@
 """Pylons middleware initialization"""
+import logging, os, time
+from functools import partial
+
 from beaker.middleware import SessionMiddleware
 from paste.cascade import Cascade
 from paste.registry import RegistryManager
@@ -9,8 +12,15 @@ from pylons.wsgiapp import PylonsApp
 from routes.middleware import RoutesMiddleware
 
 from lr.config.environment import load_environment
+from lr.lib import metrics
+from lr.lib.middleware import (FirstRequestTimer, JSONErrorMiddleware,
+                               ProfileMiddleware)
+import lr.model
+
+log = logging.getLogger(__name__)
 
-def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
+def make_app(global_conf, full_stack=True, static_files=True, api_mode=False,
+             **app_conf):
     """Create a Pylons WSGI application and return it
 
     ``global_conf``
@@ -27,23 +37,41 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
         Whether this application serves its own static files; disable
         when another web server is responsible for serving them.
 
+    ``api_mode``
+        Whether to build the minimal stack for the LR service API only:
+        no sessions, no static files and no HTML error documents. Errors
+        are reported as JSON documents instead.
+
     ``app_conf``
         The application's local configuration. Normally specified in
         the [app:<name>] section of the Paste ini file (where <name>
         defaults to main).
 
     """
+    start = time.time()
+
     # Configure the Pylons environment
     config = load_environment(global_conf, app_conf)
 
     # The Pylons WSGI app
     app = PylonsApp(config=config)
 
+    if asbool(api_mode):
+        app = make_api_stack(app, config, full_stack)
+    else:
+        app = make_full_stack(app, config, global_conf, full_stack,
+                              static_files)
+    return finish_app(app, config, start)
+
+def make_full_stack(app, config, global_conf, full_stack=True,
+                    static_files=True):
+    """Wrap the Pylons app in the middleware the browsable site needs"""
     # Routing/Session Middleware
     app = RoutesMiddleware(app, config['routes.map'])
     app = SessionMiddleware(app, config)
 
     # CUSTOM MIDDLEWARE HERE (filtered by error handling middlewares)
+    app = make_profiler(app, config)
 
     if asbool(full_stack):
         # Handle Python exceptions
@@ -63,5 +91,64 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
         # Serve static files
         static_app = StaticURLParser(config['pylons.paths']['static_files'])
         app = Cascade([static_app, app])
+    return app
+
+def make_api_stack(app, config, full_stack=True):
+    """Wrap the Pylons app in the middleware the service API needs
+
+    Machine to machine calls never use sessions, static files or error
+    documents, so only routing, JSON error handling and the registry that
+    backs the Pylons globals are kept.
+
+    """
+    app = RoutesMiddleware(app, config['routes.map'])
+    app = make_profiler(app, config)
+
+    if asbool(full_stack):
+        app = JSONErrorMiddleware(app, debug=asbool(config['debug']))
+
+    app = RegistryManager(app)
+    return app
+
+def finish_app(app, config, start):
+    """Attach the config and the warm-up hook to the outermost app
+
+    Servers that fork call app.warmup() once beforehand so every worker
+    inherits the parsed model specs and node documents, and
+    app.warmup(reload=True) to load them again before replacing their
+    workers.
+
+    """
+    app = FirstRequestTimer(app)
     app.config = config
+    app.warmup = partial(lr.model.warmup, config)
+
+    elapsed = time.time() - start
+    metrics.registry.gauge('lr_startup_seconds').set(elapsed)
+    log.info("Application built in %.3fs", elapsed)
     return app
+
+def make_profiler(app, config):
+    """Wrap app in the sampling profiler when profiling is configured
+
+    ``profile.sample_rate``
+        Fraction of requests to profile, 0 (the default) to 1.
+
+    ``profile.token``
+        Requests whose X-LR-Profile header carries this value are always
+        profiled.
+
+    ``profile.dump_interval``
+        Seconds between writes of the aggregated profiles to
+        <cache_dir>/profiles.
+
+    """
+    app_conf = config['app_conf']
+    sample_rate = float(app_conf.get('profile.sample_rate', 0))
+    token = app_conf.get('profile.token') or None
+    if not sample_rate and not token:
+        return app
+    return ProfileMiddleware(app,
+                             os.path.join(app_conf['cache_dir'], 'profiles'),
+                             sample_rate=sample_rate, token=token,
+                             dump_interval=int(app_conf.get('profile.dump_interval', 300)))
@@ -12,9 +12,9 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import logging
+import logging, json, time
 
-from pylons import request, response, session, tmpl_context as c, url
+from pylons import request, response, session, tmpl_context as c, url, app_globals
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
@@ -29,10 +29,9 @@ class DescriptionController(BaseController):
 
     def index(self, format='html'):
         """GET /description: All items in the collection"""
-        import urllib2, json, time, os
-        url = 'http://localhost:5984/node/description'
-        response = urllib2.urlopen(url)
-        data = json.load(response)
+        data = app_globals.node_cache.get('description')
+        if data is None:
+            abort(404)
         data['timestamp'] = time.asctime()
         return json.dumps(data)
         # url('description')
@@ -11,12 +11,13 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-import logging, couchdb, urlparse, json, urllib2
+import logging, couchdb, urlparse, json, urllib2, time
 
 from pylons import request, response, session, tmpl_context as c, url
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
+from lr.lib import metrics
 
 log = logging.getLogger(__name__)
 
@@ -38,7 +39,9 @@ class DistributeController(BaseController):
         social_community = 'social_community'
         server = couchdb.Server()
         db = server['node']
-        rows = db.view('_design/node/_view/connections').rows
+        with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                        db='node', op='view').time():
+            rows = db.view('_design/node/_view/connections').rows
         source_description = json.load(urllib2.urlopen('http://localhost/description'))       
         for doc in rows:           
             connection_info = doc.value
@@ -56,7 +59,13 @@ class DistributeController(BaseController):
                 continue
             if connection_info[gateway_connection] and source_description[gateway_node] and description[gateway_node]:
                 continue
-            server.replicate(db_to_replicate,base_location)
+            with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                            db='_replicate',
+                                            op='replicate').time():
+                server.replicate(db_to_replicate,base_location)
+            metrics.registry.counter('lr_distribute_replications_total').inc()
+            metrics.registry.gauge('lr_distribute_last_replication_timestamp').set(time.time())
+            metrics.registry.setInfo('out_sync_node', base_location)
         # url('distribute')
 
     def new(self, format='html'):
@@ -0,0 +1,17 @@
+import logging
+
+from pylons import response
+
+from lr.lib.base import BaseController
+from lr.lib import metrics
+
+log = logging.getLogger(__name__)
+
+class MetricsController(BaseController):
+
+    """Exports the node's in-process metrics in the Prometheus text format"""
+
+    def index(self):
+        """GET /metrics: Every metric of this process"""
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        return metrics.registry.exposition()
@@ -17,6 +17,7 @@ from pylons import request, response, session, tmpl_context as c, url
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
+from lr.lib import metrics
 
 log = logging.getLogger(__name__)
 
@@ -29,16 +30,25 @@ class ObtainController(BaseController):
     def index(self, format='html'):
         """GET /obtain: All items in the collection"""
         url = 'http://localhost:5984/resource_data/_all_docs'
-        response = urllib2.urlopen(url)
-        return response.read()
+        metrics.registry.counter('lr_obtain_requests_total').inc()
+        with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                        db='resource_data',
+                                        op='all_docs').time():
+            response = urllib2.urlopen(url)
+            return response.read()
         # url('obtain')
     def create(self):
         """POST /obtain: Create a new item"""
         data = json.loads(request.body)
         keys = map(lambda key: key['doc_ID'],data['request_IDs'])
-        return_data = urllib2.urlopen('http://localhost:5984/resource_data/_all_docs?include_docs=true',json.dumps({'keys': keys}))
-        return_data = json.load(return_data)
+        metrics.registry.counter('lr_obtain_requests_total').inc()
+        with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                        db='resource_data',
+                                        op='all_docs').time():
+            return_data = urllib2.urlopen('http://localhost:5984/resource_data/_all_docs?include_docs=true',json.dumps({'keys': keys}))
+            return_data = json.load(return_data)
 	return_data = {'documents' : map(lambda doc: doc['doc'],return_data['rows'])}
+        metrics.registry.counter('lr_obtain_documents_total').inc(len(return_data['documents']))
         return json.dumps(return_data)
         # url('obtain')
 
@@ -67,8 +77,12 @@ class ObtainController(BaseController):
     def show(self, id, format='html'):
         """GET /obtain/id: Show a specific item"""
         url = 'http://localhost:5984/resource_data/'+id
-        r = urllib2.urlopen(url)
-        data = r.read()
+        metrics.registry.counter('lr_obtain_requests_total').inc()
+        with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                        db='resource_data', op='get').time():
+            r = urllib2.urlopen(url)
+            data = r.read()
+        metrics.registry.counter('lr_obtain_documents_total').inc()
         return data
         # url('obtain', id=ID)
 
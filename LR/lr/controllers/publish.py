@@ -18,10 +18,15 @@ from pylons import request, response, session, tmpl_context as c, url
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
+from lr.lib import metrics
 import lr.model as m
 
 log = logging.getLogger(__name__)
 
+_decodeStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='decode')
+_processStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='process')
+_encodeStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='encode')
+
 class PublishController(BaseController):
     """REST Controller styled on the Atom Publishing Protocol"""
     # To properly map this controller, ensure your config/routing.py
@@ -41,12 +46,16 @@ class PublishController(BaseController):
 ##                return {'doc_ID': doc_id, 'OK': True}
 ##            except Exception as inst:       
 ##                return{'doc_ID': '', 'OK': False, 'error': inst}            
-        data = json.loads(request.body)
+        with _decodeStage.time():
+            data = json.loads(request.body)
+        metrics.registry.counter('lr_publish_requests_total').inc()
 ##        
-        results = map(m.processObject,data['documents'])
+        with _processStage.time():
+            results = map(m.processObject,data['documents'])
 ##        data = json.loads(request.body)
 #        results = m.processObject(data['documents'])
-        return json.dumps({'OK':True, 'document_results':results})
+        with _encodeStage.time():
+            return json.dumps({'OK':True, 'document_results':results})
         """POST /publisher: Create a new item"""
         # url('publisher')
 
@@ -11,9 +11,9 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-import logging
+import logging, json, time
 
-from pylons import request, response, session, tmpl_context as c, url
+from pylons import request, response, session, tmpl_context as c, url, app_globals
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
@@ -28,10 +28,9 @@ class ServicesController(BaseController):
 
     def index(self, format='html'):
         """GET /services: All items in the collection"""
-        import urllib2, json, time, os
-        url = 'http://localhost:5984/node/services'
-        response = urllib2.urlopen(url)
-        data = json.load(response)
+        data = app_globals.node_cache.get('services')
+        if data is None:
+            abort(404)
         data['timestamp'] = time.asctime()
         return json.dumps(data)
         # url('services')
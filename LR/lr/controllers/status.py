@@ -11,15 +11,27 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-import logging
+import logging, json, time, couchdb
 
-from pylons import request, response, session, tmpl_context as c, url
+from pylons import request, response, session, tmpl_context as c, url, app_globals, config
 from pylons.controllers.util import abort, redirect
 
 from lr.lib.base import BaseController, render
+from lr.lib import metrics
 
 log = logging.getLogger(__name__)
 
+# How long, in seconds, the document count of the resource data database is
+# reused before CouchDB is asked again.
+_DOC_COUNT_EXPIRE = 60
+
+def _fetchDocCount():
+    dbName = config['app_conf']['couchdb.dbname']
+    db = couchdb.Server(config['app_conf']['couchdb.url'])[dbName]
+    with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                    db=dbName, op='info').time():
+        return db.info()['doc_count']
+
 class StatusController(BaseController):
     """REST Controller styled on the Atom Publishing Protocol"""
     # To properly map this controller, ensure your config/routing.py
@@ -28,12 +40,26 @@ class StatusController(BaseController):
 
     def index(self, format='html'):
         """GET /status: All items in the collection"""
-        import urllib2, json, time, os
-        url = 'http://localhost:5984/node/status'
-        response = urllib2.urlopen(url)
-        data = json.load(response)
+        data = app_globals.node_cache.get('status')
+        if data is None:
+            abort(404)
         data['timestamp'] = time.asctime()
-        data['start_time'] = os.system('who -b')
+        data['start_time'] = app_globals.node_cache.bootTime
+        description = app_globals.node_cache.peek('description')
+        if description is not None:
+            data['node_id'] = description.get('node_id', data.get('node_id'))
+            data['node_name'] = description.get('node_name', data.get('node_name'))
+        try:
+            data['doc_count'] = app_globals.cache.get_cache(
+                'status', type='memory', expire=_DOC_COUNT_EXPIRE).get(
+                key='doc_count', createfunc=_fetchDocCount)
+        except Exception:
+            log.exception("Could not read the resource data document count.")
+        lastOutSync = metrics.registry.gauge('lr_distribute_last_replication_timestamp').value
+        if lastOutSync:
+            data['last_out_sync'] = time.asctime(time.localtime(lastOutSync))
+            data['out_sync_node'] = metrics.registry.getInfo('out_sync_node')
+        data['stats'] = metrics.registry.snapshot()
         return json.dumps(data)
         # url('status')
 
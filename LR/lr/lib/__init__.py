@@ -1,3 +1,4 @@
 from model_parser import ModelParser
+from node_cache import NodeCache
 
-__all__=[ModelParser]
\ No newline at end of file
+__all__=[ModelParser, NodeCache]
\ No newline at end of file
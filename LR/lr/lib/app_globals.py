@@ -1,8 +1,13 @@
 """The application's Globals object"""
+import logging
 
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from lr.lib.node_cache import NodeCache
+
+log = logging.getLogger(__name__)
+
 class Globals(object):
 
     """Globals acts as a container for objects available throughout the
@@ -17,3 +22,11 @@ class Globals(object):
 
         """
         self.cache = CacheManager(**parse_cache_config_options(config))
+
+        # The node documents are served from memory; a node that starts
+        # before CouchDB does is filled in by the cache's changes follower.
+        self.node_cache = NodeCache(config['app_conf']['couchdb.url'])
+        try:
+            self.node_cache.load()
+        except Exception:
+            log.exception("Could not load the node database at startup.")
@@ -0,0 +1,224 @@
+'''
+Lightweight in-process metrics for the node services.
+
+Counters, gauges and histograms are kept per process and identified by a
+name plus an optional set of labels, e.g.
+
+    metrics.registry.counter('lr_publish_rejected_total', reason='filter').inc()
+
+    with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                    db='resource_data', op='save').time():
+        db.save(doc)
+
+Looking a metric up builds a small key, so hot paths may keep a reference
+to the metric object instead. Registry.exposition renders every metric in
+the Prometheus text format served by /metrics.
+'''
+
+import bisect, threading, time
+
+# Upper bounds, in seconds, of the default latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+class Counter(object):
+    '''Monotonic counter that also knows its rate over a sliding window.'''
+
+    def __init__(self, window=60):
+        self._lock = threading.Lock()
+        self._window = window
+        self._slots = [0] * window
+        self._stamps = [0] * window
+        self.value = 0
+
+    def inc(self, amount=1):
+        now = int(time.time())
+        slot = now % self._window
+        self._lock.acquire()
+        try:
+            self.value += amount
+            if self._stamps[slot] != now:
+                self._stamps[slot] = now
+                self._slots[slot] = 0
+            self._slots[slot] += amount
+        finally:
+            self._lock.release()
+
+    def rate(self):
+        '''Average increments per second over the window.'''
+        oldest = int(time.time()) - self._window
+        total = 0
+        for stamp, count in zip(self._stamps, self._slots):
+            if stamp > oldest:
+                total += count
+        return float(total) / self._window
+
+    def snapshot(self):
+        return {'value': self.value, 'rate': round(self.rate(), 3)}
+
+    def exposition(self, name, labels):
+        return ['%s%s %s' % (name, _formatLabels(labels), self.value)]
+
+class Gauge(object):
+    '''Value that is set rather than accumulated.'''
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+    def exposition(self, name, labels):
+        return ['%s%s %s' % (name, _formatLabels(labels), self.value)]
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._histogram.observe(time.time() - self._start)
+        return False
+
+class Histogram(object):
+    '''Distribution of observed values over fixed buckets.'''
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.bounds = tuple(bounds)
+        # One extra slot for observations above the last bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.bounds, value)
+        self._lock.acquire()
+        try:
+            self.counts[slot] += 1
+            self.count += 1
+            self.sum += value
+        finally:
+            self._lock.release()
+
+    def time(self):
+        '''Context manager observing the duration of its block.'''
+        return _Timer(self)
+
+    def snapshot(self):
+        mean = 0.0
+        if self.count:
+            mean = self.sum / self.count
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'mean': round(mean, 6)}
+
+    def exposition(self, name, labels):
+        lines = []
+        cumulative = 0
+        bounds = [repr(bound) for bound in self.bounds] + ['+Inf']
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                name, _formatLabels(labels + (('le', bound),)), cumulative))
+        lines.append('%s_sum%s %r' % (name, _formatLabels(labels), self.sum))
+        lines.append('%s_count%s %d' % (name, _formatLabels(labels), self.count))
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (key, _escape(value))
+                              for key, value in labels])
+
+_TYPES = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}
+
+class Registry(object):
+    '''Process wide collection of named metrics.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._info = {}
+        self._help = {}
+
+    def _get(self, factory, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            self._lock.acquire()
+            try:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = factory()
+            finally:
+                self._lock.release()
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def describe(self, name, text):
+        '''Set the HELP text exported for every metric called name.'''
+        self._help[name] = text
+
+    def setInfo(self, key, value):
+        '''Record a non numeric fact, such as the last node synced with.'''
+        self._info[key] = value
+
+    def getInfo(self, key, default=None):
+        return self._info.get(key, default)
+
+    def items(self):
+        '''Return (name, labels, metric) tuples sorted by name and labels.'''
+        return [(name, labels, metric) for (name, labels), metric
+                in sorted(self._metrics.items())]
+
+    def snapshot(self):
+        '''JSON serializable view of every metric.'''
+        result = {}
+        for name, labels, metric in self.items():
+            if labels:
+                name = '%s{%s}' % (name, ','.join(['%s=%s' % label
+                                                   for label in labels]))
+            result[name] = metric.snapshot()
+        return result
+
+    def exposition(self):
+        '''Render every metric in the Prometheus text exposition format.'''
+        lines = []
+        lastName = None
+        for name, labels, metric in self.items():
+            if name != lastName:
+                if name in self._help:
+                    lines.append('# HELP %s %s' % (name, self._help[name]))
+                lines.append('# TYPE %s %s' % (name, _TYPES[type(metric)]))
+                lastName = name
+            lines.extend(metric.exposition(name, labels))
+        lines.append('')
+        return '\n'.join(lines)
+
+registry = Registry()
+registry.describe('lr_publish_documents_total',
+                  'Documents saved by the publish service.')
+registry.describe('lr_publish_rejected_total',
+                  'Published documents that were not saved, by reason.')
+registry.describe('lr_publish_stage_seconds',
+                  'Time spent in each stage of a publish request.')
+registry.describe('lr_couchdb_request_seconds',
+                  'Latency of the CouchDB requests made by the services.')
@@ -0,0 +1,190 @@
+"""WSGI middleware used by the LR middleware stack
+
+See lr.config.middleware for where each of these is installed.
+"""
+import atexit, cProfile, json, logging, os, pstats, random, sys, threading, time
+import traceback
+
+from lr.lib import metrics
+
+log = logging.getLogger(__name__)
+
+def _discard(data):
+    pass
+
+def _isJSON(headers):
+    for name, value in headers:
+        if name.lower() == 'content-type':
+            return 'json' in value
+    return False
+
+class JSONErrorMiddleware(object):
+
+    """Reports errors to machine clients as JSON documents.
+
+    Uncaught exceptions become a 500 response and error statuses whose body
+    is not already JSON are replaced with {"OK": false, "error": <reason>},
+    the shape the services use for their own failures. Successful responses
+    are passed through untouched. The wrapped application must call
+    start_response before returning its body, as Pylons does.
+
+    """
+
+    def __init__(self, app, debug=False):
+        self.app = app
+        self.debug = debug
+
+    def __call__(self, environ, start_response):
+        replaced = []
+
+        def replacing_start_response(status, headers, exc_info=None):
+            if int(status[:3]) < 400 or _isJSON(headers):
+                return start_response(status, headers, exc_info)
+            replaced[:] = [status]
+            return _discard
+
+        try:
+            app_iter = self.app(environ, replacing_start_response)
+        except Exception:
+            log.exception("Error while serving %s %s",
+                          environ.get('REQUEST_METHOD'),
+                          environ.get('PATH_INFO'))
+            return self._respond(start_response, '500 Internal Server Error',
+                                 'Internal Server Error', sys.exc_info())
+        if not replaced:
+            return app_iter
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+        status = replaced[0]
+        return self._respond(start_response, status, status[4:])
+
+    def _respond(self, start_response, status, error, exc_info=None):
+        data = {'OK': False, 'error': error}
+        if self.debug and exc_info is not None:
+            data['traceback'] = ''.join(traceback.format_exception(*exc_info))
+        body = json.dumps(data)
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))], exc_info)
+        return [body]
+
+class ProfileMiddleware(object):
+
+    """Profiles a sample of requests with cProfile.
+
+    A request is profiled when it is picked by the sample_rate lottery or
+    when it carries an X-LR-Profile header equal to the configured token.
+    Profiles are aggregated per controller action and written every
+    dump_interval seconds, 0 for after every profiled request, and when the
+    process exits to <profile_dir>/<controller>.<action>.<pid>.prof, ready
+    for pstats or any other offline viewer. Requests that are not
+    sampled only pay for one random number and one header lookup.
+
+    """
+
+    def __init__(self, app, profile_dir, sample_rate=0.0, token=None,
+                 dump_interval=300):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.token = token
+        self.dump_interval = dump_interval
+        self._stats = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        # threads don't survive a fork, each process starts its own dumper
+        self._dumper_pid = None
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        # workers that leave with os._exit() rely on the periodic dumps
+        atexit.register(self.dump)
+
+    def __call__(self, environ, start_response):
+        if not (random.random() < self.sample_rate or
+                (self.token and
+                 environ.get('HTTP_X_LR_PROFILE') == self.token)):
+            return self.app(environ, start_response)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            app_iter = self.app(environ, start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        finally:
+            profile.disable()
+        self._record(environ, profile)
+        return body
+
+    def _record(self, environ, profile):
+        routes = environ.get('wsgiorg.routing_args', ((), {}))[1]
+        key = '%s.%s' % (routes.get('controller', 'unrouted'),
+                         routes.get('action', 'none'))
+        self._lock.acquire()
+        try:
+            if key in self._stats:
+                self._stats[key].add(profile)
+            else:
+                self._stats[key] = pstats.Stats(profile)
+            self._dirty = True
+            if not self.dump_interval:
+                self._dump()
+            elif self._dumper_pid != os.getpid():
+                self._dumper_pid = os.getpid()
+                dumper = threading.Thread(target=self._dump_periodically)
+                dumper.setDaemon(True)
+                dumper.start()
+        finally:
+            self._lock.release()
+
+    def _dump_periodically(self):
+        while True:
+            time.sleep(self.dump_interval)
+            self.dump()
+
+    def dump(self):
+        """Writes the profiles if any were recorded since the last dump"""
+        self._lock.acquire()
+        try:
+            if self._dirty:
+                self._dump()
+        finally:
+            self._lock.release()
+
+    def _dump(self):
+        self._dirty = False
+        for key, stats in self._stats.items():
+            path = os.path.join(self.profile_dir,
+                                '%s.%d.prof' % (key, os.getpid()))
+            try:
+                stats.dump_stats(path)
+            except (IOError, OSError):
+                log.exception("Could not write profile %s", path)
+
+class FirstRequestTimer(object):
+
+    """Reports how long the first request served by each process takes.
+
+    The first request pays for importing its controller and for anything
+    that was not warmed up before the process was forked.
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._pid = None
+
+    def __call__(self, environ, start_response):
+        if self._pid == os.getpid():
+            return self.app(environ, start_response)
+        self._pid = os.getpid()
+        start = time.time()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            elapsed = time.time() - start
+            metrics.registry.gauge('lr_worker_first_request_seconds').set(elapsed)
+            log.info("Process %d served its first request in %.3fs",
+                     self._pid, elapsed)
@@ -0,0 +1,110 @@
+'''
+In-process cache of the documents stored in the node database.
+
+The status, description, services and policy documents change rarely but
+are read on every request to their service. The cache loads the whole node
+database once and then follows its _changes feed from a background thread,
+so readers never touch CouchDB.
+'''
+
+import logging, os, threading, time
+import couchdb
+
+log = logging.getLogger(__name__)
+
+def _readBootTime():
+    '''Return the system boot time, falling back to the process start time.'''
+    try:
+        for line in open('/proc/stat'):
+            if line.startswith('btime'):
+                return time.asctime(time.localtime(int(line.split()[1])))
+    except (IOError, ValueError):
+        pass
+    return time.asctime()
+
+class NodeCache(object):
+    '''Copy-on-write cache of the node database keyed by document id.
+
+    Readers take no lock: every update builds a new dictionary and swaps
+    the reference. The changes follower is started lazily in each process
+    so a cache created before a fork keeps itself current in the children.
+    '''
+
+    def __init__(self, couchUrl, dbName='node', heartbeat=30000, retryDelay=5):
+        self._server = couchdb.Server(couchUrl)
+        self._dbName = dbName
+        self._heartbeat = heartbeat
+        self._retryDelay = retryDelay
+        self._docs = {}
+        self._seq = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._followerPid = None
+        self.bootTime = _readBootTime()
+
+    def load(self):
+        '''Read every document of the node database into the cache.'''
+        db = self._server[self._dbName]
+        # Take the sequence first so no change is lost between the read
+        # and the start of the feed.
+        seq = db.info()['update_seq']
+        docs = {}
+        for row in db.view('_all_docs', include_docs=True):
+            if row.doc is not None:
+                docs[row.id] = dict(row.doc)
+        self._docs = docs
+        self._seq = seq
+        self.loaded = True
+
+    def get(self, docId):
+        '''Return a shallow copy of the cached document or None.'''
+        self._ensureFollowing()
+        doc = self._docs.get(docId)
+        if doc is None:
+            return None
+        return dict(doc)
+
+    def peek(self, docId):
+        '''Return the cached document itself; callers must not modify it.'''
+        self._ensureFollowing()
+        return self._docs.get(docId)
+
+    def _apply(self, change):
+        if 'seq' not in change:
+            # The feed terminates with a last_seq line.
+            return
+        docs = dict(self._docs)
+        if change.get('deleted'):
+            docs.pop(change['id'], None)
+        elif change.get('doc') is not None:
+            docs[change['id']] = dict(change['doc'])
+        self._docs = docs
+        self._seq = change['seq']
+
+    def _ensureFollowing(self):
+        if self._followerPid == os.getpid():
+            return
+        self._lock.acquire()
+        try:
+            if self._followerPid != os.getpid():
+                follower = threading.Thread(target=self._follow,
+                                            name='node-cache-follower')
+                follower.setDaemon(True)
+                follower.start()
+                self._followerPid = os.getpid()
+        finally:
+            self._lock.release()
+
+    def _follow(self):
+        while True:
+            try:
+                if not self.loaded:
+                    self.load()
+                db = self._server[self._dbName]
+                for change in db.changes(feed='continuous', since=self._seq,
+                                         heartbeat=self._heartbeat,
+                                         include_docs=True):
+                    self._apply(change)
+            except Exception:
+                log.exception("Lost the node database changes feed, retrying.")
+            time.sleep(self._retryDelay)
@@ -6,20 +6,20 @@ Created on Feb 24, 2011
 @author: John Poyau
 '''
 
-from lr.lib import ModelParser
+from lr.lib import ModelParser, metrics
 from pylons import *
 from uuid import uuid4
-import couchdb, os, logging, datetime, re, pprint 
+import couchdb, os, logging, datetime, re, pprint, threading, time
 log = logging.getLogger(__name__)
 
 #load all the models spec.
 dataModelsDict = {}
 
-#initialize the couchDB server
-couchServer =  couchdb.Server(config['app_conf']['couchdb.url'])    
+#The couchDB server, created by warmup().
+couchServer = None
 
-def loadModels():
-    modelDir = config['app_conf']['models_spec_dir']
+def loadModels(modelDir):
+    models = {}
     for file in os.listdir(modelDir):
         try:
             filePath = os.path.join(modelDir, file)
@@ -27,10 +27,10 @@ def loadModels():
         except Exception as e:
             print("Failed to parse model spec file: "+filePath+"\n"+str(e)+"\n\n")
             continue
-        dataModelsDict[model.modelName] = model
-
-#Load all the models. 
-loadModels()
+        models[model.modelName] = model
+    # replace the specs as a whole so a removed spec does not linger
+    dataModelsDict.clear()
+    dataModelsDict.update(models)
 
 _DOC_ID = 'doc_ID'
 _DOC_TYPE = 'doc_type'
@@ -46,25 +46,86 @@ _FILTER_VALUE = 'filter_value'
 _INCLUDE_EXCLUDE = 'include_exclude'
 _REGEX = 'regex'
 
-nodeFilter = None
-nodeDescription = None
-try:
-    nodeFilter = couchServer['node'][_FILTER_DESCRIPTION]
-    nodeDescription = couchServer['node']['description']
-except:
-    pass
-    
-#Compile the filters regular expression if we not using custom node filter.
-if nodeFilter is not None and  nodeFilter[_CUSTOM_FILTER] == False:
-    for filter in nodeFilter[_FILTER]:
-        #put the actual key in 'key' for easy retrival.
-        filter[_KEY] = filter.keys()[0]
-        filter[_REGEX] = re.compile(filter.values()[0])
-        
-  
+_published = metrics.registry.counter('lr_publish_documents_total')
+_validateStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='validate')
+_filterStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='filter')
+_saveStage = metrics.registry.histogram('lr_publish_stage_seconds', stage='save')
+
+#Nothing is read at import time: warmup() is called explicitly before the
+#server forks its workers, or else by the first published document.
+_initLock = threading.Lock()
+_nodeCache = None
+_compiledFilter = (None, None)
+
+def warmup(appConfig=None, reload=False):
+    """Load the model specs and the node documents used by processObject.
+
+    Only the first call loads anything, unless reload is set: then the
+    model specs are parsed and the node database is read again, e.g.
+    before a forking server replaces its workers.
+    """
+    global couchServer, _nodeCache, _compiledFilter
+    if _nodeCache is not None and not reload:
+        return
+    _initLock.acquire()
+    try:
+        if _nodeCache is not None and not reload:
+            return
+        if appConfig is None:
+            appConfig = config
+        start = time.time()
+        loadModels(appConfig['app_conf']['models_spec_dir'])
+        couchServer = couchdb.Server(appConfig['app_conf']['couchdb.url'])
+        nodeCache = appConfig['pylons.app_globals'].node_cache
+        if reload or not nodeCache.loaded:
+            try:
+                nodeCache.load()
+            except Exception:
+                log.exception("Could not load the node database, "
+                              "it will be loaded from its changes feed.")
+        _nodeCache = nodeCache
+        _compiledFilter = (None, None)
+        elapsed = time.time() - start
+        metrics.registry.gauge('lr_model_init_seconds').set(elapsed)
+        log.info("Model initialized in %.3fs (%d model specs)",
+                 elapsed, len(dataModelsDict))
+    finally:
+        _initLock.release()
+
+def getNodeFilter():
+    """Return the node filter description with its filters compiled.
+
+    The filter follows the node database through the node cache and is
+    only recompiled when its revision changes.
+    """
+    global _compiledFilter
+    warmup()
+    nodeFilter = _nodeCache.peek(_FILTER_DESCRIPTION)
+    if nodeFilter is None:
+        return None
+    rev = nodeFilter.get('_rev')
+    if rev is None or _compiledFilter[0] != rev:
+        compiled = dict(nodeFilter)
+        #Compile the filters regular expression if we not using custom node filter.
+        if compiled[_CUSTOM_FILTER] == False:
+            compiled[_FILTER] = []
+            for filter in nodeFilter[_FILTER]:
+                filter = dict(filter)
+                #put the actual key in 'key' for easy retrival.
+                filter[_KEY] = filter.keys()[0]
+                filter[_REGEX] = re.compile(filter.values()[0])
+                compiled[_FILTER].append(filter)
+        _compiledFilter = (rev, compiled)
+    return _compiledFilter[1]
+
+def getNodeDescription():
+    warmup()
+    return _nodeCache.peek('description')
+
 def isResourceDataFilteredOut(jsonObject):
+    nodeFilter = getNodeFilter()
     if nodeFilter is None:
-        return False
+        return [False, None]
     
     if nodeFilter[_CUSTOM_FILTER] == True:
         #Do custom the filter I supposed ... for now just resturn false.
@@ -98,11 +159,14 @@ def isResourceDataFilteredOut(jsonObject):
 def processObject(jsonObject):
     
     results= {_DOC_ID:'', 'OK':False}
+    warmup()
     
     if _DOC_TYPE not in jsonObject.keys():
         results[_ERROR] = "Document is missing doc type."
+        metrics.registry.counter('lr_publish_rejected_total',
+                                 reason='doc_type').inc()
         log.error("\n"+pprint.pformat(results, indent=4)+"\n"+
-                  rint.pformat(jsonObject, indent=4)+"\n\n")
+                  pprint.pformat(jsonObject, indent=4)+"\n\n")
         return results
     
     #If the document is resource data set the create_timpestap and 
@@ -114,7 +178,7 @@ def processObject(jsonObject):
         jsonObject['node_timestamp'] = timeStamp
         
         #set the publishing_node as this node.
-        jsonObject['publishing_node'] = nodeDescription['node_id']
+        jsonObject['publishing_node'] = getNodeDescription()['node_id']
         #Check for document Id if not present generate one.
         if _DOC_ID not in jsonObject.keys() or jsonObject[_DOC_ID] is None:
             jsonObject[_DOC_ID] = uuid4().hex
@@ -123,10 +187,13 @@ def processObject(jsonObject):
             
         #Now that we have the time validate the the data.
         try:
-            dataModelsDict[jsonObject[_DOC_TYPE]].validate(jsonObject)
+            with _validateStage.time():
+                dataModelsDict[jsonObject[_DOC_TYPE]].validate(jsonObject)
         except Exception as e:
             results[_ERROR] = "Validation Error: "+str(e)
             results['OK'] = False
+            metrics.registry.counter('lr_publish_rejected_total',
+                                     reason='validation').inc()
             log.error("\n"+pprint.pformat(results, indent=4)+"\n"+
                       pprint.pformat(jsonObject, indent=4)+"\n\n")
             return results
@@ -138,18 +205,28 @@ def processObject(jsonObject):
         jsonObject['_id']= jsonObject[_DOC_ID]
     
     db = couchServer[jsonObject[_DOC_TYPE]]
-    isFilteredOut, reason = isResourceDataFilteredOut(jsonObject)
+    with _filterStage.time():
+        isFilteredOut, reason = isResourceDataFilteredOut(jsonObject)
     
     if isFilteredOut == False:
         try:
-            results[_DOC_ID], results[_DOC_REV]= doc_rev = db.save(jsonObject)
+            with _saveStage.time():
+                with metrics.registry.histogram('lr_couchdb_request_seconds',
+                                                db=jsonObject[_DOC_TYPE],
+                                                op='save').time():
+                    results[_DOC_ID], results[_DOC_REV]= doc_rev = db.save(jsonObject)
+            _published.inc()
         except Exception as e:
             results[_ERROR] = "CouchDB save error:  "+str(e)
             results['OK'] = False
+            metrics.registry.counter('lr_publish_rejected_total',
+                                     reason='save').inc()
             log.error("\n"+pprint.pformat(results, indent=4)+"\n"+
                       pprint.pformat(jsonObject, indent=4)+"\n\n")
             return results
     else:
+        metrics.registry.counter('lr_publish_rejected_total',
+                                 reason='filter').inc()
         log.debug("filter out document: "+reason+"\n"+
                    pprint.pformat(jsonObject, indent=4, width=80)+"\n\n")
         
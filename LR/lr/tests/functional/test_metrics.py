@@ -0,0 +1,8 @@
+from lr.tests import *
+
+class TestMetricsController(TestController):
+
+    def test_index(self):
+        response = self.app.get(url('metrics'))
+        assert response.content_type == 'text/plain'
+        assert '# TYPE' in response.body
@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from lr.lib.metrics import Registry
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_is_shared_by_name_and_labels(self):
+        self.registry.counter('rejected', reason='filter').inc()
+        self.registry.counter('rejected', reason='filter').inc(2)
+        self.registry.counter('rejected', reason='validation').inc()
+        self.assertEqual(self.registry.counter('rejected', reason='filter').value, 3)
+        self.assertTrue(self.registry.counter('rejected', reason='filter').rate() > 0)
+
+    def test_histogram_buckets(self):
+        histogram = self.registry.histogram('latency')
+        histogram.observe(0.001)
+        histogram.observe(0.3)
+        histogram.observe(60)
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.counts[0], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+
+    def test_timer_observes_block(self):
+        with self.registry.histogram('latency').time():
+            pass
+        self.assertEqual(self.registry.histogram('latency').count, 1)
+
+    def test_snapshot(self):
+        self.registry.counter('published').inc()
+        self.registry.gauge('last', node='a').set(5)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['published']['value'], 1)
+        self.assertEqual(snapshot['last{node=a}'], 5)
+
+    def test_exposition(self):
+        self.registry.describe('latency', 'Request latency.')
+        self.registry.histogram('latency', stage='save').observe(0.002)
+        text = self.registry.exposition()
+        self.assertTrue('# HELP latency Request latency.' in text)
+        self.assertTrue('# TYPE latency histogram' in text)
+        self.assertTrue('latency_bucket{stage="save",le="0.001"} 0' in text)
+        self.assertTrue('latency_bucket{stage="save",le="+Inf"} 1' in text)
+        self.assertTrue('latency_count{stage="save"} 1' in text)
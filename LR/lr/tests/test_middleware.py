@@ -0,0 +1,84 @@
+import json, os, shutil, tempfile, time
+from unittest import TestCase
+
+from lr.lib.middleware import JSONErrorMiddleware, ProfileMiddleware
+
+def _call(app):
+    started = []
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, dict(headers)]
+    body = ''.join(JSONErrorMiddleware(app)({}, start_response))
+    return started[0], started[1], body
+
+class TestJSONErrorMiddleware(TestCase):
+
+    def test_success_passes_through(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['hello']
+        status, headers, body = _call(app)
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, 'hello')
+
+    def test_html_error_becomes_json(self):
+        def app(environ, start_response):
+            start_response('404 Not Found', [('Content-Type', 'text/html')])
+            return ['<html>Not Found</html>']
+        status, headers, body = _call(app)
+        self.assertEqual(status, '404 Not Found')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(body), {'OK': False, 'error': 'Not Found'})
+
+    def test_exception_becomes_json(self):
+        def app(environ, start_response):
+            raise ValueError('broken')
+        status, headers, body = _call(app)
+        self.assertEqual(status, '500 Internal Server Error')
+        self.assertEqual(json.loads(body)['OK'], False)
+
+class TestProfileMiddleware(TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def _app(self, environ, start_response):
+        environ['wsgiorg.routing_args'] = ((), {'controller': 'obtain',
+                                                'action': 'index'})
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['hello']
+
+    def test_token_request_is_profiled(self):
+        app = ProfileMiddleware(self._app, self.profile_dir, token='secret',
+                                dump_interval=0)
+        body = app({'HTTP_X_LR_PROFILE': 'secret'}, lambda *args: None)
+        self.assertEqual(''.join(body), 'hello')
+        self.assertEqual(os.listdir(self.profile_dir),
+                         ['obtain.index.%d.prof' % os.getpid()])
+
+    def test_unsampled_request_is_not_profiled(self):
+        app = ProfileMiddleware(self._app, self.profile_dir, token='secret',
+                                dump_interval=0)
+        app({'HTTP_X_LR_PROFILE': 'wrong'}, lambda *args: None)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profiles_are_dumped_every_interval(self):
+        app = ProfileMiddleware(self._app, self.profile_dir, token='secret',
+                                dump_interval=0.05)
+        app({'HTTP_X_LR_PROFILE': 'secret'}, lambda *args: None)
+        deadline = time.time() + 5
+        while not os.listdir(self.profile_dir) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(os.listdir(self.profile_dir),
+                         ['obtain.index.%d.prof' % os.getpid()])
+
+    def test_dump_writes_recorded_profiles(self):
+        app = ProfileMiddleware(self._app, self.profile_dir, token='secret',
+                                dump_interval=3600)
+        app({'HTTP_X_LR_PROFILE': 'secret'}, lambda *args: None)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+        app.dump()
+        self.assertEqual(os.listdir(self.profile_dir),
+                         ['obtain.index.%d.prof' % os.getpid()])
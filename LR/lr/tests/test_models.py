@@ -0,0 +1,48 @@
+import os
+from unittest import TestCase
+
+import lr.model
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'models')
+
+class FakeNodeCache(object):
+
+    def __init__(self):
+        self.loaded = False
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        self.loaded = True
+
+class FakeGlobals(object):
+    pass
+
+class TestWarmup(TestCase):
+
+    def setUp(self):
+        self.nodeCache = FakeNodeCache()
+        app_globals = FakeGlobals()
+        app_globals.node_cache = self.nodeCache
+        self.config = {'app_conf': {'models_spec_dir': MODELS_DIR,
+                                    'couchdb.url': 'http://localhost:5984/'},
+                       'pylons.app_globals': app_globals}
+        lr.model._nodeCache = None
+
+    def tearDown(self):
+        lr.model._nodeCache = None
+
+    def test_loads_once(self):
+        lr.model.warmup(self.config)
+        lr.model.warmup(self.config)
+        self.assertEqual(self.nodeCache.loads, 1)
+        self.assertTrue(lr.model.dataModelsDict)
+
+    def test_reload_loads_again(self):
+        lr.model.warmup(self.config)
+        lr.model._compiledFilter = ('1-abc', {})
+        lr.model.dataModelsDict['stale'] = None
+        lr.model.warmup(self.config, reload=True)
+        self.assertEqual(self.nodeCache.loads, 2)
+        self.assertEqual(lr.model._compiledFilter, (None, None))
+        self.assertFalse('stale' in lr.model.dataModelsDict)
@@ -0,0 +1,33 @@
+import os
+from unittest import TestCase
+
+from lr.lib.node_cache import NodeCache
+
+class TestNodeCache(TestCase):
+
+    def setUp(self):
+        self.cache = NodeCache('http://localhost:5984/')
+        # Pretend the follower is already running in this process.
+        self.cache._followerPid = os.getpid()
+        self.cache._apply({'seq': 1, 'id': 'status',
+                           'doc': {'_id': 'status', 'active': True}})
+
+    def test_get_returns_copy(self):
+        doc = self.cache.get('status')
+        doc['timestamp'] = 'now'
+        self.assertFalse('timestamp' in self.cache.get('status'))
+
+    def test_change_replaces_document(self):
+        self.cache._apply({'seq': 2, 'id': 'status',
+                           'doc': {'_id': 'status', 'active': False}})
+        self.assertEqual(self.cache.get('status')['active'], False)
+        self.assertEqual(self.cache._seq, 2)
+
+    def test_deleted_document(self):
+        self.cache._apply({'seq': 3, 'id': 'status', 'deleted': True})
+        self.assertEqual(self.cache.get('status'), None)
+
+    def test_last_seq_line_is_ignored(self):
+        self.cache._apply({'last_seq': 9})
+        self.assertEqual(self.cache._seq, 1)
+
@@ -0,0 +1,28 @@
+/*
+ * Counts the objects CPython allocates, for bench_middleware.py.
+ *
+ * libpython calls PyObject_Malloc through its PLT, so preloading this
+ * library sees every small object allocation of a stock interpreter:
+ *
+ *     gcc -shared -fPIC -O2 -o alloc_count.so tests/alloc_count.c -ldl
+ *     LD_PRELOAD=./alloc_count.so python tests/bench_middleware.py development.ini
+ */
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stddef.h>
+
+static void *(*real_malloc)(size_t);
+static unsigned long allocations;
+
+void *PyObject_Malloc(size_t size)
+{
+    if (real_malloc == NULL)
+        real_malloc = (void *(*)(size_t))dlsym(RTLD_NEXT, "PyObject_Malloc");
+    allocations++;
+    return real_malloc(size);
+}
+
+unsigned long lr_alloc_count(void)
+{
+    return allocations;
+}
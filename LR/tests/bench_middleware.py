@@ -0,0 +1,106 @@
+#!/usr/bin/python
+'''
+Compares the per request cost of the full and the API only middleware stacks.
+
+Each stack is built from the same ini file and called directly, without a
+server, twice: around a no-op WSGI app, which measures the middleware
+alone, and around the Pylons app with GET /metrics (a route that never
+touches CouchDB):
+
+    python tests/bench_middleware.py development.ini [requests] [rounds]
+
+Both stacks are built with debug = false, as with debug on Routes rescans
+the controllers and rebuilds its regular expressions on every request,
+which takes most of the time of either stack. The stacks take turns for
+a number of rounds and the best round of each is reported, with the
+Python calls made per request. Objects allocated per request are reported
+when tests/alloc_count.c is preloaded, see that file.
+'''
+import os, sys, time, gc, ctypes
+from paste.deploy import appconfig
+from webob import Request
+
+from lr.config.middleware import (make_app, make_api_stack, make_full_stack,
+                                  finish_app)
+
+def noop_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['OK']
+
+def run(app, requests):
+    environ = Request.blank('/metrics').environ
+    start = time.time()
+    for i in xrange(requests):
+        body = app(dict(environ), lambda status, headers, exc_info=None: None)
+        ''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+    return time.time() - start
+
+def count_calls(app, requests):
+    calls = [0]
+    def profile(frame, event, arg):
+        if event in ('call', 'c_call'):
+            calls[0] += 1
+    sys.setprofile(profile)
+    try:
+        run(app, requests)
+    finally:
+        sys.setprofile(None)
+    return calls[0] / float(requests)
+
+def alloc_counter():
+    try:
+        counter = ctypes.CDLL(None).lr_alloc_count
+    except AttributeError:
+        return None
+    counter.restype = ctypes.c_ulong
+    return counter
+
+def count_allocations(counter, app, requests):
+    before = counter()
+    run(app, requests)
+    return (counter() - before) / float(requests)
+
+def main():
+    ini = os.path.abspath(sys.argv[1])
+    requests = len(sys.argv) > 2 and int(sys.argv[2]) or 5000
+    rounds = len(sys.argv) > 3 and int(sys.argv[3]) or 5
+    conf = appconfig('config:' + ini)
+    global_conf = dict(conf.global_conf, debug='false')
+    apps = []
+    for api_mode in ('false', 'true'):
+        local_conf = dict(conf.local_conf)
+        local_conf['api_mode'] = api_mode
+        app = make_app(global_conf, **local_conf)
+        config = app.config
+        if api_mode == 'true':
+            noop = make_api_stack(noop_app, config)
+        else:
+            noop = make_full_stack(noop_app, config, global_conf)
+        apps.append(('noop', api_mode, finish_app(noop, config, time.time())))
+        apps.append(('/metrics', api_mode, app))
+    apps.sort()
+
+    counter = alloc_counter()
+    results = []
+    for core, api_mode, app in apps:
+        run(app, 100)
+        allocations = counter and count_allocations(counter, app, 1000)
+        results.append((core, api_mode, app, count_calls(app, 100),
+                        allocations, []))
+    for i in range(rounds):
+        for core, api_mode, app, calls, allocations, times in results:
+            gc.collect()
+            times.append(run(app, requests))
+
+    print '%-9s %-8s %9s %9s %10s %11s' % ('app', 'api_mode', 'req/s',
+        'us/req', 'calls/req', 'allocs/req')
+    for core, api_mode, app, calls, allocations, times in results:
+        elapsed = min(times)
+        print '%-9s %-8s %9.1f %9.1f %10.0f %11s' % (
+            core, api_mode, requests / elapsed, elapsed * 1e6 / requests,
+            calls, allocations is None and '-' or '%.0f' % allocations)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compare the throughput of the server modes on LR-like requests.
+
+Each mode is driven on two synthetic paths:
+
+  /publish  decodes a JSON body and burns CPU, like document validation
+  /obtain   waits, like a CouchDB view read, then encodes a JSON body
+
+Any fastcgi.bench option can be given, e.g.
+    bench_modes.py --requests 5000 --concurrency 32 --mode hybrid
+
+The threaded, forking and hybrid modes need the fcgi binding built
+against libfcgi; without it only the async mode is run.
+"""
+
+import os
+import sys
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastcgi import bench
+
+DOCUMENT = {'doc_type': 'resource_data', 'resource_locator': 'http://example.com/',
+            'keys': ['math', 'science'], 'payload_placement': 'inline',
+            'resource_data': 'x' * 2048}
+
+
+def bench_app(environ, start_response):
+    if environ['PATH_INFO'] == '/publish':
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        doc = json.loads(environ['wsgi.input'].read(length))
+        total = 0
+        for x in xrange(20000):
+            total += x * len(doc['keys'])
+        body = json.dumps({'OK': True, 'total': total})
+    else:
+        time.sleep(0.005)
+        body = json.dumps({'documents': [DOCUMENT] * 10})
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def main(argv):
+    options, args = bench.option_parser().parse_args(argv)
+    bench.print_header()
+    for mode in options.mode or bench.available_modes():
+        bench.benchmark(mode, options, 'bench_modes:bench_app',
+                        options.path or ['/publish', '/obtain'],
+                        bench.print_result, json.dumps(DOCUMENT))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,506 @@
+"""
+Pure Python FastCGI server
+
+Connections are multiplexed on a single asyncore loop, so idle or slow
+web server connections cost no thread. The loop reads request bodies as
+they arrive, spooling large ones to a temporary file, and hands requests
+to a fixed pool of threads once their stdin stream is complete. The
+threads queue their output back to the loop, which they wake through a
+pipe.
+Multiplexed requests, FCGI_KEEP_CONN and FCGI_GET_VALUES are supported.
+"""
+
+import asyncore
+import errno
+import os
+import signal
+import socket
+import tempfile
+import threading
+import traceback
+import Queue
+from cStringIO import StringIO
+
+from Protocol import *
+from WSGI import WSGIMixIn
+
+
+class _Stream:
+    """stdout/stderr of a request, turned into records on the connection"""
+
+    def __init__(self, request, type):
+        self._request = request
+        self._type = type
+        self._pending = []
+        self.used = False
+
+    def write(self, data):
+        if data:
+            self._pending.append(data)
+
+    def writelines(self, lines):
+        for data in lines:
+            self.write(data)
+
+    def flush(self):
+        if self._pending:
+            data = ''.join(self._pending)
+            self._pending = []
+            self.used = True
+            self._request.send(encode_stream(self._type, self._request.id,
+                                             data, end=False))
+
+    def close(self):
+        self.flush()
+        if self.used:
+            self._request.send(encode_record(self._type, self._request.id))
+
+
+class Request:
+    """The request interface of fcgi.Request, as WSGIMixIn uses it"""
+
+    def __init__(self, connection, id, keep_conn):
+        self.id = id
+        self.keep_conn = keep_conn
+        self.aborted = False
+        self.environ = None
+        self.stdin = None
+        self.stdout = _Stream(self, FCGI_STDOUT)
+        self.stderr = _Stream(self, FCGI_STDERR)
+        # bytes of stdin received, and the protocol status a request
+        # refused for its size ends with once the rest of it is in
+        self.stdin_size = 0
+        self.refused = None
+        self._connection = connection
+        self._params = []
+        self._stdin = []
+        self._spool = None
+
+    def send(self, data):
+        if not self.aborted:
+            self._connection.send_output(data)
+
+    def finish(self, app_status=0, protocol_status=FCGI_REQUEST_COMPLETE):
+        self.stdout.close()
+        self.stderr.close()
+        self._connection.end_request(self, app_status, protocol_status)
+
+    def _add_stdin(self, data, spool_size, spool_dir):
+        self.stdin_size += len(data)
+        if self._spool is not None:
+            self._spool.write(data)
+            return
+        self._stdin.append(data)
+        if self.stdin_size > spool_size:
+            self._spool = tempfile.TemporaryFile(dir=spool_dir)
+            self._spool.writelines(self._stdin)
+            self._stdin = []
+
+    def _end_stdin(self):
+        if self._spool is None:
+            self.stdin = StringIO(''.join(self._stdin))
+        else:
+            self.stdin = self._spool
+            self.stdin.seek(0)
+        self._stdin = self._spool = None
+
+    def _drop_stdin(self):
+        if self._spool is not None:
+            self._spool.close()
+        self._stdin = self._spool = None
+
+
+class Connection(asyncore.dispatcher):
+
+    # a thread writing more than this many bytes ahead of the web server
+    # waits for the connection to drain
+    high_water = 262144
+
+    def __init__(self, server, sock, map):
+        asyncore.dispatcher.__init__(self, sock, map)
+        self._server = server
+        self._reader = RecordReader()
+        self._requests = {}
+        self._output = []
+        self._output_size = 0
+        self._drained = threading.Condition()
+        self._close_when_done = False
+
+    def busy(self):
+        return bool(self._requests)
+
+    # called from the loop
+
+    def handle_read(self):
+        try:
+            data = self.recv(65536)
+        except socket.error:
+            self.handle_close()
+            return
+        if not data:
+            return
+        for type, request_id, content in self._reader.feed(data):
+            self._record(type, request_id, content)
+
+    def _record(self, type, request_id, content):
+        if request_id == FCGI_NULL_REQUEST_ID:
+            if type == FCGI_GET_VALUES:
+                self.send_output(encode_record(
+                    FCGI_GET_VALUES_RESULT, FCGI_NULL_REQUEST_ID,
+                    encode_pairs(self._server.get_values(decode_pairs(content)))))
+            else:
+                self.send_output(encode_unknown_type(type))
+            return
+
+        if type == FCGI_BEGIN_REQUEST:
+            role, flags = decode_begin_request(content)
+            if role != FCGI_RESPONDER:
+                self.send_output(encode_end_request(request_id, 0,
+                                                    FCGI_UNKNOWN_ROLE))
+                return
+            self._requests[request_id] = Request(self, request_id,
+                                                 flags & FCGI_KEEP_CONN)
+            return
+
+        req = self._requests.get(request_id)
+        if req is None:
+            return
+
+        if type == FCGI_PARAMS:
+            if content:
+                req._params.append(content)
+            else:
+                req.environ = dict(decode_pairs(''.join(req._params)))
+                req._params = None
+                limit = self._server.max_body_size
+                try:
+                    declared = int(req.environ.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    declared = 0
+                if limit and declared > limit:
+                    self._refuse(req)
+        elif type == FCGI_STDIN:
+            if req.refused is not None:
+                # the body is dropped, the request ends once it is in
+                if not content:
+                    req.finish(0, req.refused)
+            elif req.stdin is not None:
+                return
+            elif content:
+                limit = self._server.max_body_size
+                if limit and req.stdin_size + len(content) > limit:
+                    self._refuse(req)
+                else:
+                    req._add_stdin(content, self._server.spool_size,
+                                   self._server.spool_dir)
+            else:
+                req._end_stdin()
+                if not self._server.submit(req):
+                    self.end_request(req, 0, FCGI_OVERLOADED)
+        elif type == FCGI_ABORT_REQUEST:
+            # a request already in the pool runs to the end, but its
+            # output is dropped
+            req.aborted = True
+            if req.stdin is None:
+                req._drop_stdin()
+                self.end_request(req, 0)
+
+    def _refuse(self, req):
+        # answered at once, but ended only after the rest of the body:
+        # closing the connection while the web server is still sending
+        # would reset it, answer and all
+        req._drop_stdin()
+        if self._server.handle_too_large(req):
+            req.refused = FCGI_REQUEST_COMPLETE
+        else:
+            req.refused = FCGI_OVERLOADED
+
+    def writable(self):
+        return bool(self._output) or (self._close_when_done and self.connected)
+
+    def handle_write(self):
+        self._drained.acquire()
+        try:
+            data = ''.join(self._output)
+            try:
+                sent = self.send(data)
+            except socket.error:
+                sent = 0
+            data = data[sent:]
+            if data:
+                self._output = [data]
+            else:
+                self._output = []
+            self._output_size = len(data)
+            self._drained.notifyAll()
+        finally:
+            self._drained.release()
+        if not self._output and self._close_when_done:
+            self.handle_close()
+
+    def handle_close(self):
+        self._drained.acquire()
+        try:
+            for req in self._requests.values():
+                req.aborted = True
+            self._output = []
+            self._output_size = 0
+            self._drained.notifyAll()
+        finally:
+            self._drained.release()
+        self.close()
+
+    def handle_error(self):
+        traceback.print_exc()
+        self.handle_close()
+
+    # called from the loop or from a pool thread
+
+    def _append_output(self, data):
+        # with _drained held
+        while (self._output_size > self.high_water and self.connected
+               and threading.currentThread() is not self._server.loop_thread):
+            self._drained.wait()
+        if self.connected:
+            self._output.append(data)
+            self._output_size += len(data)
+
+    def send_output(self, data):
+        self._drained.acquire()
+        try:
+            self._append_output(data)
+        finally:
+            self._drained.release()
+        self._server.wakeup()
+
+    def end_request(self, req, app_status=0,
+                    protocol_status=FCGI_REQUEST_COMPLETE):
+        self._drained.acquire()
+        try:
+            # sent even for an aborted request, the web server waits for
+            # it. The web server may reuse the id as soon as it has
+            # END_REQUEST, so the request is forgotten and the connection
+            # marked for closing before the loop can send it, and a new
+            # request that already took over the id is left alone.
+            self._append_output(encode_end_request(req.id, app_status,
+                                                   protocol_status))
+            if self._requests.get(req.id) is req:
+                del self._requests[req.id]
+            if not req.keep_conn:
+                self._close_when_done = True
+        finally:
+            self._drained.release()
+        self._server.wakeup()
+
+
+class _Listener(asyncore.dispatcher):
+    def __init__(self, server, sock, map):
+        asyncore.dispatcher.__init__(self, sock, map)
+        self._server = server
+        self.accepting = True
+
+    def handle_accept(self):
+        try:
+            accepted = self.accept()
+        except socket.error:
+            return
+        if accepted is not None:
+            Connection(self._server, accepted[0], self._map)
+
+    def writable(self):
+        return False
+
+
+class _Waker(asyncore.file_dispatcher):
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except (OSError, socket.error):
+            pass
+
+    def writable(self):
+        return False
+
+
+def _listen_socket():
+    """The listen socket the web server passed as fd 0"""
+    family = socket.AF_UNIX
+    sock = socket.fromfd(FCGI_LISTENSOCK_FILENO, family, socket.SOCK_STREAM)
+    try:
+        # Linux SO_DOMAIN
+        family = sock.getsockopt(socket.SOL_SOCKET,
+                                 getattr(socket, 'SO_DOMAIN', 39))
+    except socket.error:
+        return sock
+    if family != socket.AF_UNIX:
+        sock.close()
+        sock = socket.fromfd(FCGI_LISTENSOCK_FILENO, family, socket.SOCK_STREAM)
+    return sock
+
+
+class AsyncServer:
+    """
+    Serves on the listen socket passed as fd 0, or on address (a Unix
+    socket path or a (host, port) pair) when one is given. workers
+    threads run handle(), at most backlog requests are queued or running
+    before new ones are refused with FCGI_OVERLOADED.
+
+    SIGTERM and SIGINT stop accepting connections and return from
+    serve_forever() once the requests in progress are done.
+    """
+
+    # Request bodies are read by the loop as they arrive: up to spool_size
+    # bytes are kept in memory, larger ones are spooled to a temporary
+    # file in spool_dir (None for the system default). A request whose
+    # body is over max_body_size bytes, 0 for no limit, is answered by
+    # handle_too_large() and the rest of its body dropped.
+    spool_size = 262144
+    spool_dir = None
+    max_body_size = 0
+
+    def __init__(self, workers=5, backlog=1024, address=None):
+        self._workers = workers
+        self._backlog = backlog
+        self._address = address
+        self._queue = Queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.loop_thread = None
+
+    def error(self, req, e):
+        """Override me"""
+        raise NotImplementedError
+
+    def handle(self, req):
+        """Override me"""
+        raise NotImplementedError
+
+    def warmup(self, reload=False):
+        """Override me: called once before workers are started"""
+        pass
+
+    def handle_too_large(self, req):
+        """Override me: called from the loop to answer a request whose body
+        is over max_body_size, returns the number of bytes written, 0 to
+        refuse the request with FCGI_OVERLOADED instead"""
+        return 0
+
+    def get_values(self, names):
+        values = {'FCGI_MAX_CONNS': str(self._backlog),
+                  'FCGI_MAX_REQS': str(self._backlog),
+                  'FCGI_MPXS_CONNS': '1'}
+        return [(name, values[name]) for name, value in names
+                if name in values]
+
+    def submit(self, req):
+        self._lock.acquire()
+        try:
+            if self._pending >= self._backlog:
+                return False
+            self._pending += 1
+        finally:
+            self._lock.release()
+        self._queue.put(req)
+        return True
+
+    def wakeup(self):
+        if threading.currentThread() is self.loop_thread:
+            return
+        try:
+            os.write(self._wake_w, '\0')
+        except OSError, e:
+            # the pipe is full, the loop will wake up anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _worker(self):
+        while True:
+            req = self._queue.get()
+            if req is None:
+                return
+            status = 0
+            try:
+                try:
+                    self.handle(req)
+                except Exception, e:
+                    status = 1
+                    self.error(req, e)
+            finally:
+                req.finish(status)
+                self._lock.acquire()
+                self._pending -= 1
+                self._lock.release()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _bind(self):
+        if self._address is None:
+            return _listen_socket()
+        if isinstance(self._address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self._address)
+        sock.listen(128)
+        return sock
+
+    def serve_forever(self):
+        self.warmup()
+
+        map = {}
+        self.loop_thread = threading.currentThread()
+        self._wake_r, self._wake_w = os.pipe()
+        _Waker(self._wake_r, map)
+        os.close(self._wake_r)
+        import fcntl
+        fcntl.fcntl(self._wake_w, fcntl.F_SETFL,
+                    fcntl.fcntl(self._wake_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        listener = _Listener(self, self._bind(), map)
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        threads = []
+        for x in range(self._workers):
+            t = threading.Thread(target=self._worker)
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+
+        try:
+            while not self._stopping:
+                asyncore.loop(1.0, False, map, 1)
+
+            listener.close()
+            while self._pending or [c for c in map.values()
+                                    if isinstance(c, Connection) and
+                                    (c.busy() or c.writable())]:
+                asyncore.loop(0.1, False, map, 1)
+        finally:
+            for t in threads:
+                self._queue.put(None)
+            for t in threads:
+                t.join()
+            asyncore.close_all(map)
+            os.close(self._wake_w)
+
+
+class AsyncWSGIServer(WSGIMixIn, AsyncServer):
+
+    _environ = { 'wsgi.version':      (1,0),
+                 'wsgi.multithread':  True,
+                 'wsgi.multiprocess': False,
+                 'wsgi.run_once':     False }
+
+    def __init__(self, app, workers=5, backlog=1024, address=None):
+        AsyncServer.__init__(self, workers, backlog, address)
+
+        self._app = app
+
+    def read_body(self, req):
+        # the loop has already spooled the body and held it to max_body_size
+        req.environ['CONTENT_LENGTH'] = str(req.stdin_size)
+        return req.stdin
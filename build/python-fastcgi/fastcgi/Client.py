@@ -0,0 +1,79 @@
+"""
+Minimal blocking FastCGI client, for testing and benchmarking servers
+without a web server in front of them.
+"""
+
+import socket
+
+from Protocol import *
+
+
+class Client:
+    """
+    Sends responder requests to a FastCGI server listening on a Unix
+    socket path or a (host, port) address.
+
+    With keep_conn the connection is kept open between requests, which
+    only servers that honour FCGI_KEEP_CONN support.
+    """
+
+    def __init__(self, address, keep_conn=False):
+        self._address = address
+        self._keep_conn = keep_conn
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        if isinstance(self._address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(self._address)
+        self._sock = sock
+        self._reader = RecordReader()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, params, stdin='', request_id=1):
+        """
+        Run one request and return (status, headers, body, stderr).
+        params are the CGI environment variables of the request.
+        """
+        if self._sock is None:
+            self._connect()
+
+        flags = 0
+        if self._keep_conn:
+            flags = FCGI_KEEP_CONN
+        params = dict(params)
+        params.setdefault('CONTENT_LENGTH', str(len(stdin)))
+        self._sock.sendall(''.join((
+            encode_begin_request(request_id, FCGI_RESPONDER, flags),
+            encode_stream(FCGI_PARAMS, request_id, encode_pairs(params.items())),
+            encode_stream(FCGI_STDIN, request_id, stdin))))
+
+        stdout = []
+        stderr = []
+        try:
+            while True:
+                data = self._sock.recv(65536)
+                if not data:
+                    raise IOError('connection closed before the request ended')
+                for type, rid, content in self._reader.feed(data):
+                    if rid != request_id:
+                        continue
+                    if type == FCGI_STDOUT:
+                        stdout.append(content)
+                    elif type == FCGI_STDERR:
+                        stderr.append(content)
+                    elif type == FCGI_END_REQUEST:
+                        if not self._keep_conn:
+                            self.close()
+                        status, headers, body = parse_response(''.join(stdout))
+                        return status, headers, body, ''.join(stderr)
+        except:
+            self.close()
+            raise
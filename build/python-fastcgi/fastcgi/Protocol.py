@@ -0,0 +1,179 @@
+"""
+FastCGI record protocol, as described by the FastCGI 1.0 specification
+
+Pure Python encoding and decoding of records, shared by the FastCGI client
+and the pure Python server.
+"""
+
+import struct
+
+FCGI_LISTENSOCK_FILENO = 0
+FCGI_VERSION_1 = 1
+FCGI_MAX_CONTENT = 65535
+FCGI_NULL_REQUEST_ID = 0
+
+# record types
+FCGI_BEGIN_REQUEST = 1
+FCGI_ABORT_REQUEST = 2
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_DATA = 8
+FCGI_GET_VALUES = 9
+FCGI_GET_VALUES_RESULT = 10
+FCGI_UNKNOWN_TYPE = 11
+
+# roles
+FCGI_RESPONDER = 1
+FCGI_AUTHORIZER = 2
+FCGI_FILTER = 3
+
+# begin request flags
+FCGI_KEEP_CONN = 1
+
+# end request protocol status
+FCGI_REQUEST_COMPLETE = 0
+FCGI_CANT_MPX_CONN = 1
+FCGI_OVERLOADED = 2
+FCGI_UNKNOWN_ROLE = 3
+
+_header = struct.Struct('!BBHHBx')
+_begin_request = struct.Struct('!HB5x')
+_end_request = struct.Struct('!IB3x')
+_unknown_type = struct.Struct('!B7x')
+
+FCGI_HEADER_LEN = _header.size
+
+# largest multiple of 8 that fits in a record
+_STREAM_CHUNK = FCGI_MAX_CONTENT & ~7
+
+
+def encode_record(type, request_id, content=''):
+    """Encode one record, content must fit in a single record"""
+    length = len(content)
+    padding = -length & 7
+    return ''.join((_header.pack(FCGI_VERSION_1, type, request_id,
+                                 length, padding),
+                    content, '\0' * padding))
+
+
+def encode_stream(type, request_id, data, end=True):
+    """Encode data as records of a stream, optionally closing the stream"""
+    records = []
+    for offset in xrange(0, len(data), _STREAM_CHUNK):
+        records.append(encode_record(type, request_id,
+                                     data[offset:offset + _STREAM_CHUNK]))
+    if end:
+        records.append(encode_record(type, request_id))
+    return ''.join(records)
+
+
+def _encode_length(length):
+    if length < 128:
+        return chr(length)
+    return struct.pack('!I', length | 0x80000000)
+
+
+def encode_pairs(pairs):
+    """Encode (name, value) pairs as a name-value pair stream"""
+    parts = []
+    for name, value in pairs:
+        name = str(name)
+        value = str(value)
+        parts.append(_encode_length(len(name)))
+        parts.append(_encode_length(len(value)))
+        parts.append(name)
+        parts.append(value)
+    return ''.join(parts)
+
+
+def _decode_length(data, offset):
+    length = ord(data[offset])
+    if length < 128:
+        return length, offset + 1
+    return struct.unpack('!I', data[offset:offset + 4])[0] & 0x7fffffff, offset + 4
+
+
+def decode_pairs(data):
+    """Decode a name-value pair stream into a list of (name, value)"""
+    pairs = []
+    offset = 0
+    while offset < len(data):
+        name_length, offset = _decode_length(data, offset)
+        value_length, offset = _decode_length(data, offset)
+        name = data[offset:offset + name_length]
+        offset += name_length
+        pairs.append((name, data[offset:offset + value_length]))
+        offset += value_length
+    return pairs
+
+
+def encode_begin_request(request_id, role=FCGI_RESPONDER, flags=0):
+    return encode_record(FCGI_BEGIN_REQUEST, request_id,
+                         _begin_request.pack(role, flags))
+
+
+def decode_begin_request(content):
+    """Return (role, flags)"""
+    return _begin_request.unpack(content[:_begin_request.size])
+
+
+def encode_end_request(request_id, app_status=0,
+                       protocol_status=FCGI_REQUEST_COMPLETE):
+    return encode_record(FCGI_END_REQUEST, request_id,
+                         _end_request.pack(app_status, protocol_status))
+
+
+def decode_end_request(content):
+    """Return (app_status, protocol_status)"""
+    return _end_request.unpack(content[:_end_request.size])
+
+
+def encode_unknown_type(type):
+    return encode_record(FCGI_UNKNOWN_TYPE, FCGI_NULL_REQUEST_ID,
+                         _unknown_type.pack(type))
+
+
+class RecordReader:
+    """
+    Incremental record parser: feed() it bytes as they arrive and get
+    back the (type, request_id, content) of every completed record.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+
+    def feed(self, data):
+        buffer = self._buffer + data
+        records = []
+        offset = 0
+        while len(buffer) - offset >= FCGI_HEADER_LEN:
+            version, type, request_id, length, padding = \
+                _header.unpack(buffer[offset:offset + FCGI_HEADER_LEN])
+            end = offset + FCGI_HEADER_LEN + length + padding
+            if len(buffer) < end:
+                break
+            start = offset + FCGI_HEADER_LEN
+            records.append((type, request_id, buffer[start:start + length]))
+            offset = end
+        self._buffer = buffer[offset:]
+        return records
+
+
+def parse_response(stdout):
+    """Split CGI response output into (status, headers, body)"""
+    head, sep, body = stdout.partition('\r\n\r\n')
+    if not sep:
+        head, sep, body = stdout.partition('\n\n')
+    status = '200 OK'
+    headers = []
+    for line in head.splitlines():
+        name, _, value = line.partition(':')
+        value = value.strip()
+        if name.lower() == 'status':
+            status = value
+        else:
+            headers.append((name, value))
+    return status, headers, body
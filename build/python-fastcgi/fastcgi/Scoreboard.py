@@ -0,0 +1,112 @@
+"""
+Worker scoreboard shared between a supervising master and its workers
+
+The scoreboard is an anonymous shared memory map created by the master
+before it forks, so every worker inherits it. Each worker owns one slot
+and is the only writer of its request counters, the master assigns and
+frees slots and reads all of them to size the pool and to report on
+stuck or overloaded workers.
+"""
+
+import mmap
+import struct
+import time
+
+# slot states
+SLOT_FREE = 0
+SLOT_STARTING = 1
+SLOT_READY = 2
+SLOT_STOPPING = 3
+
+_STATE_NAMES = {SLOT_FREE: 'free', SLOT_STARTING: 'starting',
+                SLOT_READY: 'ready', SLOT_STOPPING: 'stopping'}
+
+# Slot fields, written one at a time so the master and the worker never
+# overwrite each other's changes to a slot:
+#   pid, state, requests in progress, time the worker last became idle,
+#   time the requests in progress started (0 when idle), time the worker
+#   was started, requests served and response bytes written
+_slot = struct.Struct('=iHHdddQQ')
+_PID, _STATE, _BUSY, _IDLE_SINCE, _BUSY_SINCE, _STARTED, _REQUESTS, \
+    _WRITTEN = 0, 4, 6, 8, 16, 24, 32, 40
+
+
+class Scoreboard:
+    def __init__(self, slots):
+        self._slots = slots
+        self._map = mmap.mmap(-1, _slot.size * slots)
+
+    def __len__(self):
+        return self._slots
+
+    def get(self, index):
+        """
+        Return (pid, state, busy, idle_since, busy_since, started,
+        requests, written) of a slot
+        """
+        return _slot.unpack_from(self._map, index * _slot.size)
+
+    def _put(self, index, field, format, value):
+        struct.pack_into(format, self._map, index * _slot.size + field, value)
+
+    # master side
+
+    def claim(self):
+        """Reserve a free slot for a new worker, None when all are taken"""
+        for index in xrange(self._slots):
+            if self.get(index)[1] == SLOT_FREE:
+                now = time.time()
+                _slot.pack_into(self._map, index * _slot.size,
+                                0, SLOT_STARTING, 0, now, 0.0, now, 0, 0)
+                return index
+        return None
+
+    def assign(self, index, pid):
+        self._put(index, _PID, '=i', pid)
+
+    def release(self, index):
+        _slot.pack_into(self._map, index * _slot.size,
+                        0, SLOT_FREE, 0, 0.0, 0.0, 0.0, 0, 0)
+
+    # worker side, or the master when it stops a worker
+
+    def set_state(self, index, state):
+        self._put(index, _STATE, '=H', state)
+
+    def request_started(self, index):
+        busy = self.get(index)[2]
+        if not busy:
+            self._put(index, _BUSY_SINCE, '=d', time.time())
+        self._put(index, _BUSY, '=H', busy + 1)
+
+    def request_finished(self, index, written=0):
+        slot = self.get(index)
+        busy = slot[2] - 1
+        self._put(index, _REQUESTS, '=Q', slot[6] + 1)
+        self._put(index, _WRITTEN, '=Q', slot[7] + written)
+        if not busy:
+            self._put(index, _IDLE_SINCE, '=d', time.time())
+            self._put(index, _BUSY_SINCE, '=d', 0.0)
+        self._put(index, _BUSY, '=H', busy)
+
+    # reporting
+
+    def format(self):
+        """Describe every worker in use, one line each"""
+        now = time.time()
+        lines = ['%4s %7s %-8s %4s %9s %7s %10s %12s'
+                 % ('slot', 'pid', 'state', 'busy', 'for', 'age',
+                    'requests', 'bytes')]
+        for index in xrange(self._slots):
+            pid, state, busy, idle_since, busy_since, started, requests, \
+                written = self.get(index)
+            if state == SLOT_FREE:
+                continue
+            if busy:
+                held = now - busy_since
+            else:
+                held = now - idle_since
+            lines.append('%4d %7d %-8s %4d %8.1fs %6.0fs %10d %12d'
+                         % (index, pid, _STATE_NAMES[state], busy, held,
+                            now - started, requests, written))
+        return '\n'.join(lines) + '\n'
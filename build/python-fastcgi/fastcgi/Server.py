@@ -1,35 +1,76 @@
-import fcgi
+try:
+    import fcgi
+except ImportError:
+    # without the libfcgi binding only the pure Python server in Async
+    # can be used
+    fcgi = None
 import threading
 import os
 import sys
+import time
+import errno
+import fcntl
+import select
+import signal
+import resource
+
+from Scoreboard import *
 
 
 class Server:
     def __init__(self, workers=5):
-        self._workers = workers 
+        self._workers = workers
+        self._stopping = False
 
     def _mainloop(self):
         req = fcgi.Request()
 
-        while True:
+        while not self._stopping:
             try:
-                req.accept()
+                if not self._accept(req):
+                    continue
             except:
+                if not self._stopping:
+                    sys.stderr.write('fastcgi: accept failed: %s\n'
+                                     % (sys.exc_info()[1],))
                 break
 
-            try: 
-                self.handle(req)
+            self._request_started()
+            written = 0
+            try:
+                written = self.handle(req) or 0
             except Exception, e:
                 self.error(req, e)
+            # flush the response and end the request before it counts as
+            # done, the worker may exit as soon as it does
+            req.finish()
+            self._request_finished(written)
+
+    def _accept(self, req):
+        """Accepts the next request, returns False to look at _stopping
+        again without one"""
+        req.accept()
+        return True
+
+    def _request_started(self):
+        pass
+
+    def _request_finished(self, written):
+        pass
 
     def error(self, req, e):
         """Override me"""
         raise NotImplementedError
 
     def handle(self, req):
-        """Override me"""
+        """Override me: may return the number of bytes written"""
         raise NotImplementedError
 
+    def warmup(self, reload=False):
+        """Override me: called once before workers are started, and with
+        reload=True before a forking server replaces them on SIGHUP"""
+        pass
+
     def serve_forever(self):
         """Override me"""
         raise NotImplementedError
@@ -37,6 +78,7 @@ class Server:
 
 class ThreadedMixIn:
     def serve_forever(self):
+        self.warmup()
 
         for x in range(self._workers - 1):
             t = threading.Thread(target=self._mainloop)
@@ -45,22 +87,367 @@ class ThreadedMixIn:
         self._mainloop()
 
 
+def _rss():
+    """Resident set size of this process in bytes"""
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * resource.getpagesize()
+        finally:
+            f.close()
+    except (IOError, ValueError, IndexError):
+        # peak rather than current size, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 class ForkingMixIn:
+    """
+    Pre-forks workers from a supervising master process.
+
+    The master serves no requests, it only watches its children:
+      - the pool holds between min_workers and max_workers workers; more
+        are started while fewer than min_spare are idle, and workers idle
+        for idle_timeout seconds are stopped while more than max_spare
+        are idle. Both bounds default to workers, a fixed size pool.
+      - a worker that dies is replaced
+      - a worker exits, and is replaced, after max_requests requests or
+        once its resident size exceeds max_rss bytes (0 disables either)
+      - SIGHUP gracefully replaces every worker: warmup(reload=True) is
+        run first, so the new workers start from freshly loaded data, and
+        each old worker finishes its current request before exiting
+      - SIGTERM or SIGINT stop the workers the same way and return
+      - SIGUSR2 writes the worker scoreboard to stderr, status() returns
+        the same report
+    """
+
+    # don't respawn a worker more often than this, in seconds, when
+    # workers die right after they are started
+    _respawn_delay = 1.0
+
+    # how often, in seconds, the master looks at the scoreboard
+    _tick = 1.0
+
+    # requests a worker can serve at once
+    _threads = 1
+
+    def _init_pool(self, min_workers=None, max_workers=None, min_spare=1,
+                   max_spare=4, idle_timeout=60):
+        if min_workers is None:
+            min_workers = self._workers
+        if max_workers is None:
+            max_workers = max(self._workers, min_workers)
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._min_spare = min_spare
+        self._max_spare = max(max_spare, min_spare)
+        self._idle_timeout = idle_timeout
+
     def serve_forever(self):
+        # warm up before forking so the children share the result
+        self.warmup()
 
-        for x in range(self._workers - 1):
-            pid = os.fork()
+        self._children = {}
+        self._running = True
+        self._reload = False
+        self._dump = False
+        # room for a whole pool that is still stopping after a reload
+        self._scoreboard = Scoreboard(self._max_workers * 2)
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGUSR2, self._on_dump)
+
+        while self._running:
+            if self._reload:
+                self._reload = False
+                self.warmup(reload=True)
+                self._signal_children(signal.SIGTERM)
+
+            if self._dump:
+                self._dump = False
+                sys.stderr.write(self.status())
+                sys.stderr.flush()
+
+            self._reap_children()
+            self._maintain_pool()
+
+            # a signal cuts the sleep short
+            time.sleep(self._tick)
+
+        self._signal_children(signal.SIGTERM)
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.ECHILD:
+                    break
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            self._reap(pid, status)
+
+    def _reap_children(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                break
             if not pid:
-                # child
-                self._mainloop()
-                sys.exit(0)
-            else:
-                # parent
+                break
+            self._reap(pid, status)
+
+    def _maintain_pool(self):
+        if not self._running:
+            return
+
+        now = time.time()
+        workers = 0
+        spare = 0
+        idle = []
+        for pid, (started, slot) in self._children.items():
+            state, busy, idle_since = self._scoreboard.get(slot)[1:4]
+            if state == SLOT_STOPPING:
                 continue
+            workers += 1
+            if busy < self._threads:
+                spare += 1
+            if not busy:
+                idle.append((idle_since, pid, slot))
+
+        wanted = max(self._min_workers - workers, self._min_spare - spare)
+        wanted = min(wanted, self._max_workers - workers)
+        if wanted > 0:
+            for x in range(wanted):
+                if self._spawn() is None:
+                    break
+            return
+
+        # stop the workers that have been idle the longest
+        excess = min(len(idle) - self._max_spare, workers - self._min_workers)
+        idle.sort()
+        for idle_since, pid, slot in idle[:max(excess, 0)]:
+            if now - idle_since < self._idle_timeout:
+                break
+            self._stop_child(pid, slot)
 
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _on_stop(self, signum, frame):
+        self._running = False
+
+    def _on_dump(self, signum, frame):
+        self._dump = True
+
+    def status(self):
+        """Report what every worker is doing, from the master or a worker"""
+        return self._scoreboard.format()
+
+    def _signal_children(self, signum):
+        for pid, (started, slot) in self._children.items():
+            self._stop_child(pid, slot, signum)
+
+    def _stop_child(self, pid, slot, signum=signal.SIGTERM):
+        self._scoreboard.set_state(slot, SLOT_STOPPING)
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    def _spawn(self):
+        slot = self._scoreboard.claim()
+        if slot is None:
+            return None
+
+        pid = os.fork()
+        if pid:
+            # parent
+            self._scoreboard.assign(slot, pid)
+            self._children[pid] = (time.time(), slot)
+            return pid
+
+        # child
+        self._slot = slot
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        status = 0
+        try:
+            self._child_main()
+        except:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        sys.stderr.flush()
+        os._exit(status)
+
+    def _reap(self, pid, status):
+        child = self._children.pop(pid, None)
+        if child is None:
+            return
+        started, slot = child
+        self._scoreboard.release(slot)
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) != signal.SIGTERM:
+            sys.stderr.write('fastcgi: worker %d killed by signal %d\n'
+                             % (pid, os.WTERMSIG(status)))
+        elif os.WIFEXITED(status) and os.WEXITSTATUS(status) != 0:
+            sys.stderr.write('fastcgi: worker %d exited with status %d\n'
+                             % (pid, os.WEXITSTATUS(status)))
+        if self._running and time.time() - started < self._respawn_delay:
+            time.sleep(self._respawn_delay)
+
+    def _ready(self):
+        # the master may already have asked this worker to stop
+        if self._scoreboard.get(self._slot)[1] == SLOT_STARTING:
+            self._scoreboard.set_state(self._slot, SLOT_READY)
+
+    # how long, in seconds, a worker waits for a connection before it
+    # looks at _stopping again
+    _accept_timeout = 0.5
+
+    def _child_init(self):
+        self._served = 0
+        self._accept_lock = threading.Lock()
+        # SIGTERM only marks the worker as stopping, it exits between
+        # requests; libfcgi's reads and writes are restarted, not failed
+        signal.signal(signal.SIGTERM, self._on_child_stop)
+        signal.siginterrupt(signal.SIGTERM, False)
+        # a worker blocked in accept() could not be stopped, so connections
+        # are waited for in _accept and accept() fails instead of blocking
+        # when another worker took the connection first
+        flags = fcntl.fcntl(0, fcntl.F_GETFL)
+        fcntl.fcntl(0, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._ready()
+
+    def _child_main(self):
+        self._child_init()
         self._mainloop()
 
+    def _accept(self, req):
+        fd = req.fileno()
+        if fd >= 0:
+            # the web server kept the connection of the last request open
+            # (FCGI_KEEP_CONN), libfcgi reads the next request from it
+            return self._wait(fd) and self._try_accept(req)
+
+        # one thread at a time waits for a connection, the others wait
+        # for their turn here
+        self._accept_lock.acquire()
+        try:
+            if self._stopping:
+                return False
+            return self._wait(0) and self._try_accept(req)
+        finally:
+            self._accept_lock.release()
+
+    def _wait(self, fd):
+        """Whether fd became readable within _accept_timeout"""
+        try:
+            return bool(select.select([fd], [], [], self._accept_timeout)[0])
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return False
+
+    def _try_accept(self, req):
+        try:
+            req.accept()
+        except IOError, e:
+            # another worker took the connection first, or the web server
+            # closed a kept connection and no new one is waiting
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return False
+        return True
+
+    def _request_started(self):
+        self._scoreboard.request_started(self._slot)
+
+    def _request_finished(self, written):
+        self._scoreboard.request_finished(self._slot, written)
+        self._served += 1
+        if self._max_requests and self._served >= self._max_requests:
+            self._stopping = True
+        elif self._max_rss and _rss() > self._max_rss:
+            self._stopping = True
+
+    def _on_child_stop(self, signum, frame):
+        self._stopping = True
+
+
+class HybridMixIn(ForkingMixIn):
+    """
+    Supervised pre-forked workers that each run several threads.
+
+    The master behaves as in ForkingMixIn. In a worker every thread
+    accepts and handles requests while the main thread only waits for
+    SIGTERM or for recycling to be due, then joins the threads once they
+    have finished the requests in hand, and exits.
+    """
+
+    def _child_main(self):
+        self._lock = threading.Lock()
+        self._child_init()
+
+        threads = []
+        for x in range(self._threads):
+            t = threading.Thread(target=self._thread_main)
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+
+        while not self._stopping:
+            time.sleep(0.5)
+        for t in threads:
+            # join with a timeout so signals are still handled
+            while t.isAlive():
+                t.join(0.5)
+
+    def _thread_main(self):
+        try:
+            self._mainloop()
+        finally:
+            # a thread that gave up takes the worker down with it, so the
+            # master replaces the worker instead of counting it as spare
+            self._stopping = True
+
+    def _request_started(self):
+        self._lock.acquire()
+        try:
+            ForkingMixIn._request_started(self)
+        finally:
+            self._lock.release()
+
+    def _request_finished(self, written):
+        self._lock.acquire()
+        try:
+            ForkingMixIn._request_finished(self, written)
+        finally:
+            self._lock.release()
+
 
 class ThreadedServer(ThreadedMixIn, Server): pass
-class ForkingServer(ForkingMixIn, Server): pass
 
+class ForkingServer(ForkingMixIn, Server):
+    def __init__(self, workers=5, max_requests=0, max_rss=0, **pool):
+        Server.__init__(self, workers)
+
+        self._max_requests = max_requests
+        self._max_rss = max_rss
+        self._init_pool(**pool)
+
+class HybridServer(HybridMixIn, Server):
+    def __init__(self, workers=5, threads=5, max_requests=0, max_rss=0,
+                 **pool):
+        Server.__init__(self, workers)
+
+        self._threads = threads
+        self._max_requests = max_requests
+        self._max_rss = max_rss
+        self._init_pool(**pool)
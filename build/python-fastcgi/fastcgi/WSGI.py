@@ -1,12 +1,115 @@
-from Server import ThreadedServer, ForkingServer
+from Server import ThreadedServer, ForkingServer, HybridServer
+from cStringIO import StringIO
+import tempfile
 import traceback
 
 
+class FileWrapper:
+    """wsgi.file_wrapper: lets the server read the file in large blocks"""
+
+    def __init__(self, filelike, blksize=65536):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
 class WSGIMixIn:
+
+    # path answered with the worker scoreboard instead of the application
+    _stats_path = None
+
+    # Small body chunks are held back and written together once this many
+    # bytes are pending, or when the response ends. 0 writes and flushes
+    # every chunk as soon as the application produces it.
+    buffer_size = 65536
+
+    # Request bodies are read before the application is called: up to
+    # spool_size bytes are kept in memory, larger ones are spooled to a
+    # temporary file in spool_dir (None for the system default). Bodies
+    # over max_body_size bytes are refused with a 413, 0 for no limit.
+    spool_size = 262144
+    spool_dir = None
+    max_body_size = 0
+
     def handle(self, req):
         environ = req.environ
-        environ['wsgi.input']        = req.stdin
+        if self._stats_path and environ.get('PATH_INFO') == self._stats_path:
+            return self.handle_stats(req)
+
+        body = self.read_body(req)
+        if body is None:
+            return self.handle_too_large(req)
+        try:
+            return self._handle(req, body)
+        finally:
+            body.close()
+
+    def read_body(self, req):
+        """
+        Read the request body into memory or a temporary file, and set
+        CONTENT_LENGTH to its actual size. Returns None when the body is
+        larger than max_body_size.
+        """
+        environ = req.environ
+        limit = self.max_body_size
+        try:
+            declared = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            declared = 0
+        if limit and declared > limit:
+            return None
+
+        chunks = []
+        size = 0
+        body = None
+        while True:
+            data = req.stdin.read(65536)
+            if not data:
+                break
+            size += len(data)
+            if limit and size > limit:
+                if body is not None:
+                    body.close()
+                return None
+            if body is None:
+                chunks.append(data)
+                if size > self.spool_size:
+                    body = tempfile.TemporaryFile(dir=self.spool_dir)
+                    body.writelines(chunks)
+                    chunks = None
+            else:
+                body.write(data)
+
+        if body is None:
+            body = StringIO(''.join(chunks))
+        else:
+            body.seek(0)
+        environ['CONTENT_LENGTH'] = str(size)
+        return body
+
+    def handle_too_large(self, req):
+        body = 'Request Entity Too Large\n'
+        req.stdout.write('Status: 413 Request Entity Too Large\r\n'
+                         'Content-Type: text/plain\r\n'
+                         'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        req.stdout.flush()
+        return len(body)
+
+    def _handle(self, req, body):
+        environ = req.environ
+        environ['wsgi.input']        = body
         environ['wsgi.errors']       = req.stderr
+        environ['wsgi.file_wrapper'] = FileWrapper
         environ.update(self._environ)
 
         if environ.get('HTTPS','off') in ('on','1'):
@@ -16,21 +119,37 @@ class WSGIMixIn:
 
         headers_set = []
         headers_sent = []
+        # chunks not written yet, their total size, and bytes written
+        pending = []
+        counts = [0, 0]
+        buffer_size = self.buffer_size
+
+        def send():
+            req.stdout.writelines(pending)
+            req.stdout.flush()
+            counts[1] += counts[0]
+            del pending[:]
+            counts[0] = 0
 
         def write(data):
             if not headers_set:
                 raise AssertionError("write() before start_response()")
 
             elif not headers_sent:
-                # Before the first output, send the stored headers
+                # Before the first output, queue the stored headers
                 status, response_headers = headers_sent[:] = headers_set
-                req.stdout.write('Status: %s\r\n' % status)
+                head = ['Status: %s\r\n' % status]
                 for header in response_headers:
-                    req.stdout.write('%s: %s\r\n' % header)
-                req.stdout.write('\r\n')
+                    head.append('%s: %s\r\n' % header)
+                head.append('\r\n')
+                head = ''.join(head)
+                pending.append(head)
+                counts[0] += len(head)
 
-            req.stdout.write(data)
-            req.stdout.flush()
+            pending.append(data)
+            counts[0] += len(data)
+            if counts[0] >= buffer_size:
+                send()
 
         def start_response(status, response_headers, exc_info=None):
             if exc_info:
@@ -53,20 +172,44 @@ class WSGIMixIn:
                     write(data)
             if not headers_sent:
                 write('')   # send headers now if body was empty
+            if pending:
+                send()
         finally:
             if hasattr(result,'close'):
                 result.close() 
+        return counts[1]
+
+    def handle_stats(self, req):
+        body = self.status()
+        req.stdout.write('Status: 200 OK\r\n'
+                         'Content-Type: text/plain\r\n'
+                         'Content-Length: %d\r\n\r\n' % len(body))
+        req.stdout.write(body)
+        req.stdout.flush()
+        return len(body)
 
     def error(self, req, e):
         traceback.print_exc(file=req.stderr)
         req.stderr.flush()
 
+    def warmup(self, reload=False):
+        # applications may expose a warmup() hook, e.g. to load their
+        # configuration or data before the server forks; on SIGHUP it is
+        # called with reload=True to load them again
+        hook = getattr(self._app, 'warmup', None)
+        if hook is None:
+            return
+        if reload:
+            hook(reload=True)
+        else:
+            hook()
+
 
 class ThreadedWSGIServer(WSGIMixIn, ThreadedServer):
 
     _environ = { 'wsgi.version':      (1,0),
                  'wsgi.multithread':  True,
-                 'wsgi.multiprocess': True,
+                 'wsgi.multiprocess': False,
                  'wsgi.run_once':     False }
 
     def __init__(self, app, workers=5):
@@ -82,8 +225,25 @@ class ForkingWSGIServer(WSGIMixIn, ForkingServer):
                  'wsgi.multiprocess': True,
                  'wsgi.run_once':     False }
 
-    def __init__(self, app, workers=5):
-        ForkingServer.__init__(self, workers)
+    def __init__(self, app, workers=5, max_requests=0, max_rss=0,
+                 stats_path=None, **pool):
+        ForkingServer.__init__(self, workers, max_requests, max_rss, **pool)
 
         self._app = app
+        self._stats_path = stats_path
+
 
+class HybridWSGIServer(WSGIMixIn, HybridServer):
+
+    _environ = { 'wsgi.version':      (1,0),
+                 'wsgi.multithread':  True,
+                 'wsgi.multiprocess': True,
+                 'wsgi.run_once':     False }
+
+    def __init__(self, app, workers=5, threads=5, max_requests=0, max_rss=0,
+                 stats_path=None, **pool):
+        HybridServer.__init__(self, workers, threads, max_requests, max_rss,
+                              **pool)
+
+        self._app = app
+        self._stats_path = stats_path
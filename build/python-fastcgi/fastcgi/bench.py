@@ -0,0 +1,317 @@
+"""
+Benchmark harness for the FastCGI servers
+
+Starts a server the way a web server would, with a Unix listen socket on
+fd 0, drives it with concurrent clients over that socket and reports
+throughput, latency percentiles and the CPU time used by each server
+process. Everything runs on localhost.
+
+usage: python -m fastcgi.bench [options]
+       python -m fastcgi.bench --help
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+from optparse import OptionParser
+
+from fastcgi.Client import Client
+
+MODES = ('threaded', 'forking', 'hybrid', 'async')
+
+
+def make_app(response_size=100, latency=0.0, cpu=0):
+    """
+    A WSGI app that reads the request body, loops cpu times, sleeps for
+    latency seconds and answers with response_size bytes
+    """
+    body = 'x' * response_size
+
+    def app(environ, start_response):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if length:
+            environ['wsgi.input'].read(length)
+        total = 0
+        for x in xrange(cpu):
+            total += x
+        if latency:
+            time.sleep(latency)
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+def load_app(spec):
+    """Import the app named by 'module:attribute'"""
+    module, attribute = spec.split(':')
+    __import__(module)
+    return getattr(sys.modules[module], attribute)
+
+
+def serve(mode, app, workers=4, threads=4):
+    import fastcgi
+    if mode == 'threaded':
+        server = fastcgi.ThreadedWSGIServer(app, workers=workers * threads)
+    elif mode == 'forking':
+        server = fastcgi.ForkingWSGIServer(app, workers=workers * threads)
+    elif mode == 'hybrid':
+        server = fastcgi.HybridWSGIServer(app, workers=workers, threads=threads)
+    else:
+        server = fastcgi.AsyncWSGIServer(app, workers=workers * threads)
+    server.serve_forever()
+
+
+def available_modes():
+    try:
+        import fcgi
+    except ImportError:
+        return ('async',)
+    return MODES
+
+
+class ServerProcess:
+    """A server started on a Unix listen socket passed as fd 0"""
+
+    def __init__(self, mode, options, app=None):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'fcgi.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(128)
+
+        args = [sys.executable, '-m', 'fastcgi.bench', '--serve', mode,
+                '--workers', str(options.workers),
+                '--threads', str(options.threads),
+                '--response-size', str(options.response_size),
+                '--latency', str(options.latency),
+                '--cpu', str(options.cpu)]
+        if app:
+            args += ['--app', app]
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p])
+        self.process = subprocess.Popen(args, stdin=listener.fileno(),
+                                        env=env)
+        listener.close()
+        self.pid = self.process.pid
+
+    def wait_ready(self, timeout=10):
+        """Wait until the server answers a request"""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                Client(self.address).request(_params('/'))
+                return
+            except (IOError, socket.error):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def stop(self):
+        try:
+            os.kill(self.pid, 15)
+        except OSError:
+            pass
+        self.process.wait()
+        shutil.rmtree(self.directory, True)
+
+
+def _params(path, length=0):
+    return {'REQUEST_METHOD': length and 'POST' or 'GET',
+            'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/octet-stream',
+            'CONTENT_LENGTH': str(length)}
+
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def process_tree(pid):
+    """pid and the pids of its children, from /proc"""
+    pids = [pid]
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            stat = open('/proc/%s/stat' % name).read()
+        except IOError:
+            continue
+        if int(stat[stat.rindex(')') + 2:].split()[1]) == pid:
+            pids.append(int(name))
+    return pids
+
+
+def cpu_seconds(pid):
+    """User plus system CPU seconds used by a process, None once it is gone"""
+    try:
+        stat = open('/proc/%d/stat' % pid).read()
+    except IOError:
+        return None
+    fields = stat[stat.rindex(')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / float(_CLK_TCK)
+
+
+def cpu_snapshot(pid):
+    snapshot = {}
+    for p in process_tree(pid):
+        seconds = cpu_seconds(p)
+        if seconds is not None:
+            snapshot[p] = seconds
+    return snapshot
+
+
+def percentile(values, fraction):
+    """values must be sorted"""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def drive(address, path='/', requests=1000, concurrency=10, request_size=0,
+          keep_conn=False, body=None):
+    """
+    Send requests from concurrency client threads and return a dict of
+    requests, errors, elapsed, throughput, p50 and p99 (seconds). The
+    request body is body, or request_size bytes when it is None.
+    """
+    if body is None:
+        body = 'x' * request_size
+    params = _params(path, len(body))
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(count):
+        c = Client(address, keep_conn)
+        for x in xrange(count):
+            began = time.time()
+            try:
+                status, headers, output, errput = c.request(params, body)
+            except (IOError, socket.error):
+                status, errput = 'error', ''
+            elapsed = time.time() - began
+            lock.acquire()
+            # an app that fails writes a traceback to stderr, not a status
+            if status.startswith('200') and not errput:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+            lock.release()
+        c.close()
+
+    share, extra = divmod(requests, concurrency)
+    threads = [threading.Thread(target=client,
+                                args=(share + (x < extra and 1 or 0),))
+               for x in range(concurrency)]
+    began = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - began
+
+    latencies.sort()
+    return {'requests': len(latencies), 'errors': errors[0],
+            'elapsed': elapsed, 'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99)}
+
+
+def benchmark(mode, options, app=None, paths=('/',), report=None,
+              body=None):
+    """
+    Run one server mode against each path, calling report(mode, path,
+    result, cpu) where cpu maps each server pid to the CPU seconds it
+    used during the run
+    """
+    server = ServerProcess(mode, options, app)
+    try:
+        server.wait_ready()
+        for path in paths:
+            before = cpu_snapshot(server.pid)
+            result = drive(server.address, path, options.requests,
+                           options.concurrency, options.request_size,
+                           options.keep_conn, body)
+            after = cpu_snapshot(server.pid)
+            cpu = {}
+            for pid, seconds in after.items():
+                cpu[pid] = seconds - before.get(pid, 0.0)
+            if report is not None:
+                report(mode, path, result, cpu)
+    finally:
+        server.stop()
+
+
+def print_header():
+    print '%-9s %-10s %9s %6s %9s %9s %8s  %s' % (
+        'mode', 'path', 'req/s', 'errors', 'p50 ms', 'p99 ms', 'cpu s',
+        'cpu s per process')
+
+
+def print_result(mode, path, result, cpu):
+    per_process = ' '.join(['%.2f' % cpu[pid] for pid in sorted(cpu)])
+    print '%-9s %-10s %9.1f %6d %9.2f %9.2f %8.2f  %s' % (
+        mode, path, result['throughput'], result['errors'],
+        result['p50'] * 1000, result['p99'] * 1000, sum(cpu.values()),
+        per_process)
+    sys.stdout.flush()
+
+
+def option_parser():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--mode', action='append', choices=MODES,
+                      help='server mode to run, may be repeated '
+                           '(default: every mode available)')
+    parser.add_option('--workers', type='int', default=4,
+                      help='processes, or thread groups, per server')
+    parser.add_option('--threads', type='int', default=4,
+                      help='threads per hybrid worker; the threaded, '
+                           'forking and async modes run workers * threads')
+    parser.add_option('--concurrency', type='int', default=16)
+    parser.add_option('--requests', type='int', default=2000)
+    parser.add_option('--request-size', type='int', default=0,
+                      help='request body bytes')
+    parser.add_option('--response-size', type='int', default=100,
+                      help='response body bytes')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds the app sleeps per request')
+    parser.add_option('--cpu', type='int', default=0,
+                      help='loop iterations the app runs per request')
+    parser.add_option('--keep-conn', action='store_true', default=False,
+                      help='reuse connections with FCGI_KEEP_CONN')
+    parser.add_option('--path', action='append',
+                      help='PATH_INFO to request, may be repeated')
+    parser.add_option('--app', help='module:attribute of a WSGI app to '
+                                    'serve instead of the synthetic one')
+    parser.add_option('--serve', help='internal: run a server on fd 0')
+    return parser
+
+
+def main(argv=None):
+    options, args = option_parser().parse_args(argv)
+
+    if options.serve:
+        if options.app:
+            app = load_app(options.app)
+        else:
+            app = make_app(options.response_size, options.latency,
+                           options.cpu)
+        serve(options.serve, app, options.workers, options.threads)
+        return
+
+    modes = options.mode or available_modes()
+    print_header()
+    for mode in modes:
+        benchmark(mode, options, options.app, options.path or ['/'],
+                  print_result)
+
+
+if __name__ == '__main__':
+    main()
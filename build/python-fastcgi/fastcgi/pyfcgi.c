@@ -702,6 +702,16 @@ fcgi_Request_finish(fcgi_Request *self)
     Py_RETURN_NONE;
 }
 
+/* FCGX_Finish_r leaves the connection open when the web server
+ * asked for FCGI_KEEP_CONN, and the next FCGX_Accept_r reads the
+ * next request from it rather than from the listen socket
+ */
+static PyObject *
+fcgi_Request_fileno(fcgi_Request *self)
+{
+    return PyInt_FromLong(self->r.ipcFd);
+}
+
 
 /* we set the streams internal
  * FCGX_Stream reference to NULL
@@ -807,6 +817,9 @@ static PyMethodDef fcgi_Request_methods[] = {
     {"finish", (PyCFunction)fcgi_Request_finish, METH_NOARGS,
      "Finish a completed request"
     },
+    {"fileno", (PyCFunction)fcgi_Request_fileno, METH_NOARGS,
+     "Web server connection of the request, -1 when there is none"
+    },
     {NULL}  /* Sentinel */
 };
 
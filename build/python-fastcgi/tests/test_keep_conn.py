@@ -0,0 +1,78 @@
+"""
+Requests sent one after another on a connection kept open with
+FCGI_KEEP_CONN are all answered, by each server mode that is available.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import socket
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fastcgi import bench
+from fastcgi.Client import Client
+
+
+class KeepConnTest(unittest.TestCase):
+
+    mode = None
+
+    def setUp(self):
+        if self.mode not in bench.available_modes():
+            self.skipTest('the libfcgi binding is not installed')
+        options, args = bench.option_parser().parse_args(
+            ['--workers', '1', '--threads', '2'])
+        self.server = bench.ServerProcess(self.mode, options)
+        self.server.wait_ready()
+        # a request left waiting on the kept connection fails the test
+        # rather than hanging it
+        self.timeout = socket.getdefaulttimeout()
+        socket.setdefaulttimeout(5)
+
+    def tearDown(self):
+        socket.setdefaulttimeout(self.timeout)
+        self.server.stop()
+
+    def test_requests_on_one_connection(self):
+        client = Client(self.server.address, keep_conn=True)
+        try:
+            for x in range(5):
+                status, headers, body, errors = client.request(
+                    bench._params('/'))
+                self.assertEqual(status, '200 OK')
+                self.assertEqual(len(body), 100)
+        finally:
+            client.close()
+
+    def test_connections_in_turn(self):
+        # a kept connection the web server closes is given up, and new
+        # connections are still accepted
+        for x in range(3):
+            client = Client(self.server.address, keep_conn=True)
+            try:
+                status = client.request(bench._params('/'))[0]
+                self.assertEqual(status, '200 OK')
+            finally:
+                client.close()
+
+
+class AsyncKeepConnTest(KeepConnTest):
+    mode = 'async'
+
+
+class ForkingKeepConnTest(KeepConnTest):
+    mode = 'forking'
+
+
+class HybridKeepConnTest(KeepConnTest):
+    mode = 'hybrid'
+
+
+del KeepConnTest
+
+
+if __name__ == '__main__':
+    unittest.main()
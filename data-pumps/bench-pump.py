@@ -0,0 +1,93 @@
+'''
+Runs the NSDL pump end to end against a local OAI-PMH stand-in and a stub
+/publish, and reports harvest and publish throughput.
+
+    python bench-pump.py [--records 10000] [--page-size 100] [--latency 0.05]
+                         [--throttle-every 20] [--transform-processes 4] ...
+
+Every record the stand-in serves, but the deleted ones, has to be published.
+The benchmark exits with an error when one is missing, or when the rate is
+below --min-rate, so it can be run as an offline regression test.
+'''
+import imp
+import logging
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from pump import standin
+
+def loadPump():
+    return imp.load_source("nsdl_to_lr_data_pump", os.path.join(HERE, "nsdl-to-lr-data-pump.py"))
+
+def configure(pump, options, url, workdir):
+    pump.configs = []
+    for i in range(options.harvests):
+        pump.configs.append(dict(pump.config, server=url, path="/oai", metadataPrefix=options.prefix,
+                                 set="set-%d" % i, incremental=False))
+    pump.HARVEST_CONCURRENCY = options.harvests
+    pump.HOST_RATE = options.hostRate
+    pump.HOST_BURST = max(1, int(options.hostRate))
+    pump.TRANSFORM_PROCESSES = options.transformProcesses
+    pump.PROGRESS_INTERVAL = options.progressInterval
+    pump.CHECKPOINT_FILE = os.path.join(workdir, "checkpoint")
+    pump.JOURNAL_FILE = options.journal and os.path.join(workdir, "journal") or None
+    pump.publishConfig = dict(pump.publishConfig, url=url, inFlight=options.inFlight,
+                              deadLetterPath=os.path.join(workdir, "deadletter"))
+
+def main(argv):
+    parser = optparse.OptionParser()
+    standin.addOptions(parser)
+    parser.add_option("--prefix", default="nsdl_dc", help="nsdl_dc or oai_dc")
+    parser.add_option("--harvests", type="int", default=1,
+                      help="sets harvested at the same time, each with its own records")
+    parser.add_option("--host-rate", dest="hostRate", type="float", default=1000,
+                      help="OAI-PMH requests per second the pump allows itself")
+    parser.add_option("--transform-processes", dest="transformProcesses", type="int", default=0)
+    parser.add_option("--in-flight", dest="inFlight", type="int", default=2)
+    parser.add_option("--journal", action="store_true", default=False)
+    parser.add_option("--progress-interval", dest="progressInterval", type="float", default=5)
+    parser.add_option("--min-rate", dest="minRate", type="float", default=0,
+                      help="fail when fewer records per second are published")
+    options, args = parser.parse_args(argv)
+
+    server = standin.fromOptions(options, ("127.0.0.1", 0))
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="bench-pump-")
+    try:
+        pump = loadPump()
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("pump.progress").setLevel(logging.INFO)
+        configure(pump, options, server.url, workdir)
+
+        started = time.time()
+        pump.connect()
+        elapsed = time.time() - started
+    finally:
+        shutil.rmtree(workdir, True)
+
+    repository = server.repository
+    live = len([i for i in range(repository.records) if not repository.isDeleted(i)])
+    expected = live * options.harvests
+    stats = server.stats
+    published = stats.get("published", 0)
+    rate = published / elapsed
+    print("%d records in %d pages, %d throttled, in %.2fs" % (
+          repository.records * options.harvests, stats.get("pages", 0), stats.get("throttled", 0), elapsed))
+    print("published %d of %d documents, %.0f documents/s" % (published, expected, rate))
+    print("harvested %.1f MB/s, published %.1f MB/s" % (
+          stats.get("bytesOut", 0) / elapsed / 1e6, stats.get("bytesIn", 0) / elapsed / 1e6))
+
+    if published != expected:
+        sys.exit("FAIL: %d documents published, %d expected" % (published, expected))
+    if rate < options.minRate:
+        sys.exit("FAIL: %.0f documents/s, below %.0f" % (rate, options.minRate))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+'''
+Compares records per second of the field map transformer against the
+original walk of the whole field map per record, on a fixed sample of
+synthetic NSDL DC records.
+
+    python bench-transform.py [records] [rounds]
+'''
+import sys
+import time
+
+import nsdl
+from nsdl.transform import Transformer
+
+class SampleRecord(object):
+    '''Stands in for an oaipmh Metadata, which is a map read through getField.'''
+    def __init__(self, map):
+        self._map = map
+
+    def getField(self, name):
+        return self._map[name]
+
+def sampleRecords(count):
+    records = []
+    for i in range(count):
+        records.append(SampleRecord({
+            'payload_locator_id': ['oai:nsdl.org:2200/%d' % i],
+            'resource_timestamp': ['2011-02-%02dT10:00:00Z' % (i % 28 + 1)],
+            'resource_locator': ['http://example.org/resource/%d' % i],
+            'resource_title': ['Resource number %d' % i],
+            'resource_subject': ['Mathematics', 'Physics', 'Subject %d' % (i % 50)],
+            'resource_language': ['en-us'],
+            'resource_education_level': ['High School', 'Grade %d' % (i % 12 + 1)],
+            'resource_type': ['Text', 'Instructional Material'],
+            'resource_description': ['A description of resource %d. ' % i * 5],
+            'resource_owner': ['Publisher %d' % (i % 20)],
+            'resource_rights': ['Copyright 2011'],
+        }))
+    return records
+
+def formatByMap(fieldMap, doc):
+    '''The per record walk of the field map this transformer replaced.'''
+    value = {}
+    for (fieldname, fieldconfig) in fieldMap.items():
+        if fieldconfig["type"] == "const" and "const" in fieldconfig:
+            value[fieldname] = fieldconfig["const"]
+        elif fieldconfig["type"] == "[string]" and len(fieldconfig["fields"]) > 0:
+            value[fieldname] = []
+            for field in fieldconfig["fields"]:
+                value[fieldname].extend(doc.getField(field))
+        elif fieldconfig["type"] == "string" and len(fieldconfig["fields"]) > 0:
+            value[fieldname] = ""
+            for field in fieldconfig["fields"]:
+                value[fieldname] += ", ".join(doc.getField(field))
+        elif fieldconfig["type"] == "boolean" and len(fieldconfig["fields"]) > 0:
+            value[fieldname] = True
+            for field in fieldconfig["fields"]:
+                value[fieldname] &= doc.getField(field)
+    return value
+
+def best(run, rounds):
+    times = []
+    for i in range(rounds):
+        started = time.time()
+        run()
+        times.append(time.time() - started)
+    return min(times)
+
+if __name__ == "__main__":
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    rounds = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+    fieldMap = nsdl.NSDL_TO_LR_MAP
+    records = sampleRecords(count)
+    transform = Transformer(fieldMap)
+
+    for doc in records[:100]:
+        assert transform(doc) == formatByMap(fieldMap, doc)
+
+    results = [
+        ("field map walk", best(lambda: [formatByMap(fieldMap, doc) for doc in records], rounds)),
+        ("compiled", best(lambda: [transform(doc) for doc in records], rounds)),
+        ("compiled batch", best(lambda: transform.batch(records), rounds)),
+    ]
+    baseline = results[0][1]
+    print("%d records, best of %d rounds" % (count, rounds))
+    for name, seconds in results:
+        print("%-16s %10.0f records/s  %5.2fx" % (name, count / seconds, baseline / seconds))
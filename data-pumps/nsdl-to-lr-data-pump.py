@@ -16,23 +16,36 @@ Reads OAI-PMH data and publishes to specific LR Node with envelopes that contain
 
 Can work with both OAI Dublin Core and NSDL Dublin Core.
 
+Usage: nsdl-to-lr-data-pump.py [pump|harvest|publish]
+
+  pump     harvests every endpoint in configs and publishes as it goes (default)
+  harvest  only harvests, into compressed segment files in SEGMENT_DIR
+  publish  publishes those segments, resuming where the last publish stopped
+
+Harvests are incremental from the last checkpoint, and records whose envelope
+is unchanged since it was last published are skipped. The settings below
+control concurrency, rate limits, batching and the files the pump keeps.
+
 Created on Feb 11, 2011
 
 @author: jklo
 '''
 
 
-from restkit.resource import Resource
-import urllib2
-import time
-from lxml import etree
-from StringIO import StringIO
 import json
 import logging
 import sys
-from urllib import urlencode
+from pump.pipeline import Pipeline
+from pump.publisher import Publisher
+from pump.harvest import Harvest, HostLimiter, fetchAll
+from pump.checkpoint import Checkpoint, checkpointKey, harvestFrom
+from pump.oai import serializeRecord
+from pump.transform import TransformPool
+from pump.segments import SegmentWriter, Offset, readSegments
+from pump.journal import Journal
+from pump.progress import Progress
 
-logging.basicConfig()
+logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("main")
 
 config = {
@@ -40,207 +53,260 @@ config = {
     "path": "/dds_se/services/oai2-0",
     "verb": "ListRecords",
     "metadataPrefix":"nsdl_dc",
-    "set":"ncs-NSDL-COLLECTION-000-003-112-016"
+    "set":"ncs-NSDL-COLLECTION-000-003-112-016",
+    "from": None,
+    "until": None,
+    "incremental": True,
+    "granularity": "YYYY-MM-DDThh:mm:ssZ"
 }
 #config = {
 #    "server": "http://hal.archives-ouvertes.fr",
 #    "path": "/oai/oai.php",
 #    "verb": "ListRecords",
 #    "metadataPrefix":"oai_dc",
-#    "set": None
+#    "set": None,
+#    "from": None,
+#    "until": None,
+#    "incremental": True,
+#    "granularity": "YYYY-MM-DD"
 #}
-namespaces = {
-              "oai" : "http://www.openarchives.org/OAI/2.0/",
-              "oai_dc" : "http://www.openarchives.org/OAI/2.0/oai_dc/",
-              "dc":"http://purl.org/dc/elements/1.1/",
-              "dct":"http://purl.org/dc/terms/",
-              "nsdl_dc":"http://ns.nsdl.org/nsdl_dc_v1.02/",
-              "ieee":"http://www.ieee.org/xsd/LOMv1p0",
-              "xsi":"http://www.w3.org/2001/XMLSchema-instance"
-              }
 # http://hal.archives-ouvertes.fr/oai/oai.php?verb=ListRecords&metadataPrefix=oai_dc
 
-class Error(Exception):
-    pass
-
-def getDocTemplate():
-    return { 
-            "doc_type": "resource_data", 
-            "doc_version": "0.10.0", 
-            "resource_data_type" : "metadata",
-            "active" : True,
-            "submitter_type": "agent",
-            "submitter": "NSDL 2 LR Data Pump",
-            "submission_TOS": "Yes",
-            "resource_locator": None,
-            "filtering_keys": [],
-            "payload_placement": None,
-            "payload_schema": [],
-            "payload_schema_locator":[],
-            "payload_locator": None,
-            "resource_data": None
-            }
-    
-
-def formatOAIDoc(record):
-    doc = getDocTemplate()
-    resource_locator = record.xpath("oai:metadata/oai_dc:dc/dc:identifier/text()", namespaces=namespaces)
-    subject = record.xpath("oai:metadata/oai_dc:dc/dc:subject/text()", namespaces=namespaces)
-    language = record.xpath("oai:metadata/oai_dc:dc/dc:language/text()", namespaces=namespaces)
-    payload = record.xpath("oai:metadata/oai_dc:dc", namespaces=namespaces)
-    
-    doc["resource_locator"] = resource_locator
-    
-    doc["filtering_keys"].extend(subject)
-    doc["filtering_keys"].extend(language)
-
-    
-    doc["payload_schema"].append("OAI DC 2.0")
-    doc["payload_schema_locator"].append("http://www.openarchives.org/OAI/2.0/oai_dc/ http://www.openarchives.org/OAI/2.0/oai_dc.xsd")
-    
-    doc["payload_placement"] = "inline"
-    doc["resource_data"] = etree.tostring(payload[0])
-    
-    for key in doc.keys():
-        if (doc[key] == None):
-            del doc[key]
-    
-    return doc
-
-def formatNSDLDoc(record):
-    doc = getDocTemplate()
-    resource_locator = record.xpath("oai:metadata/nsdl_dc:nsdl_dc/dc:identifier/text()", namespaces=namespaces)
-    subject = record.xpath("oai:metadata/nsdl_dc:nsdl_dc/dc:subject/text()", namespaces=namespaces)
-    language = record.xpath("oai:metadata/nsdl_dc:nsdl_dc/dc:language/text()", namespaces=namespaces)
-    edLevel = record.xpath("oai:metadata/nsdl_dc:nsdl_dc/dct:educationLevel/text()", namespaces=namespaces)
-    payload = record.xpath("oai:metadata/nsdl_dc:nsdl_dc", namespaces=namespaces)
-    
-    doc["resource_locator"] = resource_locator
-    
-    doc["filtering_keys"].extend(subject)
-    doc["filtering_keys"].extend(language)
-    doc["filtering_keys"].extend(edLevel)
-    
-    
-    doc["payload_schema"].append("NSDL DC 1.02.020")
-    doc["payload_schema_locator"].append("http://ns.nsdl.org/nsdl_dc_v1.02/ http://ns.nsdl.org/schemas/nsdl_dc/nsdl_dc_v1.02.xsd")
-    
-    doc["payload_placement"] = "inline"
-    doc["resource_data"] = etree.tostring(payload[0])
-    
-    for key in doc.keys():
-        if (doc[key] == None):
-            del doc[key]
-    
-    return doc
-    
-def bulkUpdate(list):
-    '''
-    Save to Learning Registry
-    '''
-    if len(list) > 0:
-        try:
-            res = Resource("http://learningregistry.couchdb:5984")
-            body = { "documents":list }
-            log.info("request body: %s" % (json.dumps(body),))
-            clientResponse = res.post(path="/publish", payload=json.dumps(body), headers={"Content-Type":"application/json"})
-            log.info("status: {0}  message: {1}".format(clientResponse.status_int, clientResponse.body_string))
-        except Exception:
-            log.exception("Caught Exception When publishing to registry")
+# every endpoint and set to harvest
+configs = [config]
 
+# endpoints harvested at the same time
+HARVEST_CONCURRENCY = 4
 
-def fetchRecords(conf):
-    '''
-    Generator to fetch all records using a resumptionToken if supplied.
-    '''
-    server = conf["server"]
-    path = conf["path"]
-    verb = conf["verb"]
-    metadataPrefix = conf["metadataPrefix"]
-    set = conf["set"]
-    
-    params = { "verb": verb, "metadataPrefix": metadataPrefix }
-    if set != None:
-        params["set"] = set
-    
-    body = makeRequest("%s%s" % (server, path), **params)
-    f = StringIO(body)
-    tree = etree.parse(f)
-    tokenList = tree.xpath("oai:ListRecords/oai:resumptionToken/text()", namespaces=namespaces)
-    yield tree.xpath("oai:ListRecords/oai:record", namespaces=namespaces)
-    
-    del params["metadataPrefix"]
-    
-    while (len(tokenList) == 1):
-        try:
-            params["resumptionToken"] = tokenList[0]
-            body = makeRequest("%s%s" % (server, path), **params)
-            f = StringIO(body)
-            tree = etree.parse(f)
-            yield tree.xpath("oai:ListRecords/oai:record", namespaces=namespaces)
-            tokenList = tree.xpath("oai:ListRecords/oai:resumptionToken/text()", namespaces=namespaces)
-        except Exception as e:
-            tokenList = []
-            log.error(sys.exc_info())
-            log.exception("Problem trying to get next segment.")
-
-WAIT_DEFAULT = 120 # two minutes
-WAIT_MAX = 5
-
-def makeRequest(base_url, credentials=None, **kw):
-        """Actually retrieve XML from the server.
-        """
-        # XXX include From header?
-        headers = {'User-Agent': 'pyoai'}
-        if credentials is not None:
-            headers['Authorization'] = 'Basic ' + credentials.strip()
-        request = urllib2.Request(
-            base_url, data=urlencode(kw), headers=headers)
-        return retrieveFromUrlWaiting(request)
-        
-def retrieveFromUrlWaiting(request,
-                           wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT):
-    """Get text from URL, handling 503 Retry-After.
-    """
-    for i in range(wait_max):
-        try:
-            f = urllib2.urlopen(request)
-            text = f.read()
-            f.close()
-            # we successfully opened without having to wait
-            break
-        except urllib2.HTTPError, e:
-            if e.code == 503:
-                try:
-                    retryAfter = int(e.hdrs.get('Retry-After'))
-                except TypeError:
-                    retryAfter = None
-                if retryAfter is None:
-                    time.sleep(wait_default)
-                else:
-                    time.sleep(retryAfter)
-            else:
-                # reraise any other HTTP error
-                raise
-    else:
-        raise Error, "Waited too often (more than %s times)" % wait_max
-    return text            
-      
+# requests per second, and burst, allowed to each OAI-PMH host
+HOST_RATE = 1.0
+HOST_BURST = 2
+# per host overrides, e.g. { "www.dls.ucar.edu": (5.0, 5) }
+HOST_RATES = {}
 
-def connect():
-    for recset in fetchRecords(config):
+CHECKPOINT_FILE = "nsdl-to-lr-data-pump.checkpoint"
+
+# OAI identifier to the hash of its last published envelope, None to publish
+# every harvested record
+JOURNAL_FILE = "nsdl-to-lr-data-pump.journal"
+
+publishConfig = {
+    "url": "http://learningregistry.couchdb:5984",
+    "inFlight": 2,          # batches posted at the same time
+    "batchSize": 100,       # first batch size, adapted to the node's latency
+    "minBatchSize": 10,
+    "maxBatchSize": 1000,
+    "targetLatency": 5.0,   # seconds a batch should take
+    "retries": 3,
+    "deadLetterPath": "nsdl-to-lr-data-pump.deadletter"
+}
+
+
+# seconds between two progress reports
+PROGRESS_INTERVAL = 10
+# print every formatted batch of envelopes to stdout
+LOG_PAYLOADS = False
+
+# worker processes formatting records, 0 formats them in the format stage itself
+TRANSFORM_PROCESSES = 0
+# records sent to a worker at once
+TRANSFORM_CHUNK = 50
+
+# where harvest mode writes envelopes, and documents per segment file
+SEGMENT_DIR = "nsdl-to-lr-data-pump.segments"
+SEGMENT_DOCS = 10000
+# how far publish mode got through the segments
+OFFSET_FILE = "nsdl-to-lr-data-pump.offset"
+# documents published between two saves of the offset
+OFFSET_INTERVAL = 1000
+
+# pages held between stages, each page is a parsed ListRecords response
+QUEUE_SIZE = 2
+
+
+def formatRecords(item, pool=None, journal=None, progress=None):
+    harvest, recset = item
+    if pool is not None:
+        docList = pool.envelopes(harvest.format, recset)
+    else:
+        envelope = harvest.format.envelope
         docList = []
         for rec in recset:
-            if config["metadataPrefix"] == "oai_dc":
-                docList.append(formatOAIDoc(rec))
-            if config["metadataPrefix"] == "nsdl_dc":
-                docList.append(formatNSDLDoc(rec))
+            docList.append(envelope(rec))
+    identifiers = [rec.identifier for rec, doc in zip(recset, docList) if doc is not None]
+    docList = [doc for doc in docList if doc is not None]
+    formatted = len(docList)
+    if journal is not None:
+        docList = journal.filter(identifiers, docList)
+    if progress is not None:
+        progress.add("formatted", formatted)
+        progress.add("skipped", formatted - len(docList))
+    if LOG_PAYLOADS:
         try:
             print(json.dumps(docList))
         except:
             log.exception("Problem w/ JSON dump")
-        bulkUpdate(docList)
-    
+    return harvest, docList
+
+def makeHarvests(checkpoint):
+    harvests = []
+    for conf in configs:
+        conf = dict(conf)
+        last = checkpoint.get(checkpointKey(conf))
+        if conf["incremental"] and last and not conf["from"]:
+            conf["from"] = harvestFrom(last["responseDate"], conf["granularity"])
+            log.info("Harvesting records changed since %s from %s%s", conf["from"], conf["server"], conf["path"])
+        harvests.append(Harvest(conf))
+    return harvests
+
+def makePool():
+    '''
+    Returns the transform pool, the record handler going with it and the
+    number of format stage workers. Call before any thread is started, the
+    pool's workers are forked.
+    '''
+    if TRANSFORM_PROCESSES:
+        # a second page is sent to the pool while the first one finishes
+        return TransformPool(TRANSFORM_PROCESSES, TRANSFORM_CHUNK), serializeRecord, 2
+    return None, None, 1
+
+def openJournal():
+    if JOURNAL_FILE:
+        return Journal(JOURNAL_FILE)
+    return None
+
+def closeJournal(journal):
+    if journal is not None:
+        log.info("Skipped %d unchanged documents", journal.skipped)
+        journal.close()
+
+def countFailures(func):
+    '''
+    Wraps a stage so a page it fails on is counted against its harvest, the
+    pipeline itself only logs and drops it.
+    '''
+    def stage(item):
+        try:
+            return func(item)
+        except Exception:
+            item[0].stageFailed()
+            raise
+    return stage
+
+def runHarvests(harvests, pool, handler, formatWorkers, journal, progress, name, sink):
+    '''
+    Harvests and formats every endpoint, handing (harvest, docList) to sink.
+    With a journal, docList only holds the documents that changed.
+    '''
+    limiter = HostLimiter(HOST_RATE, HOST_BURST, HOST_RATES)
+    pipeline = Pipeline(queueSize=QUEUE_SIZE)
+    pipeline.addStage("format", countFailures(lambda item: formatRecords(item, pool, journal, progress)),
+                      formatWorkers)
+    pipeline.addStage(name, countFailures(sink))
+    progress.pipeline = pipeline
+    pipeline.run(*fetchAll(harvests, limiter, HARVEST_CONCURRENCY, handler))
+    if pool is not None:
+        pool.close()
+
+def moveCheckpoints(checkpoint, harvests):
+    for harvest in harvests:
+        key = checkpointKey(harvest.conf)
+        if not harvest.clean():
+            log.warning("%s: harvest incomplete (%d documents failed to publish, %d pages dropped), "
+                        "checkpoint not moved", harvest, harvest.publishFailures, harvest.stageFailures)
+        elif harvest.responseDate:
+            last = checkpoint.get(key)
+            checkpoint.set(key, harvest.responseDate, harvest.datestamp or (last and last["datestamp"]))
+
+def connect():
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    harvests = makeHarvests(checkpoint)
+    pool, handler, formatWorkers = makePool()
+    journal = openJournal()
+
+    publisher = Publisher(onPublished=journal and journal.published, **publishConfig)
+    def publish(item):
+        harvest, docList = item
+        publisher.publish(docList, harvest)
+
+    progress = Progress(PROGRESS_INTERVAL, harvests, publisher=publisher)
+    progress.start()
+    runHarvests(harvests, pool, handler, formatWorkers, journal, progress, "publish", publish)
+    publisher.close()
+    progress.stop()
+    closeJournal(journal)
+
+    for harvest in harvests:
+        harvest.publishFailures = publisher.failedBy.get(harvest, 0)
+    moveCheckpoints(checkpoint, harvests)
+
+def harvestToDisk():
+    '''Harvests into segments in SEGMENT_DIR for publishFromDisk to publish.'''
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    harvests = makeHarvests(checkpoint)
+    pool, handler, formatWorkers = makePool()
+    journal = openJournal()
+
+    writer = SegmentWriter(SEGMENT_DIR, SEGMENT_DOCS)
+    progress = Progress(PROGRESS_INTERVAL, harvests)
+    def write(item):
+        harvest, docList = item
+        writer.write(docList)
+        progress.add("written", len(docList))
+
+    progress.start()
+    runHarvests(harvests, pool, handler, formatWorkers, journal, progress, "write", write)
+    writer.close()
+    progress.stop()
+    log.info("Wrote %d documents to %s", writer.written, SEGMENT_DIR)
+    closeJournal(journal)
+    if writer.failed:
+        log.warning("A segment failed to be written, no checkpoint moved")
+        return
+    moveCheckpoints(checkpoint, harvests)
+
+def publishFromDisk():
+    '''
+    Publishes the segments in SEGMENT_DIR, carrying on from OFFSET_FILE. The
+    offset only moves past documents that were published or dead lettered.
+    '''
+    offset = Offset(OFFSET_FILE)
+    if offset.value:
+        log.info("Publishing from line %d of %s", offset.value[1], offset.value[0])
+    journal = openJournal()
+    publisher = Publisher(onPublished=journal and journal.published, **publishConfig)
+    progress = Progress(PROGRESS_INTERVAL, publisher=publisher)
+    progress.start()
+    position = None
+    unflushed = 0
+    for segment, line, doc in readSegments(SEGMENT_DIR, offset.value):
+        if position is not None and position[0] != segment:
+            # a segment is done
+            publisher.flush()
+            offset.set(*position)
+            unflushed = 0
+        publisher.publish([doc])
+        position = (segment, line)
+        unflushed += 1
+        if unflushed >= OFFSET_INTERVAL:
+            publisher.flush()
+            offset.set(*position)
+            unflushed = 0
+    publisher.close()
+    if position is not None:
+        offset.set(*position)
+    progress.stop()
+    if journal is not None:
+        journal.close()
+
+MODES = {
+    "pump": connect,
+    "harvest": harvestToDisk,
+    "publish": publishFromDisk,
+}
 
 if __name__ == '__main__':
-    connect()
\ No newline at end of file
+    mode = len(sys.argv) > 1 and sys.argv[1] or "pump"
+    if mode not in MODES:
+        sys.exit("usage: %s [%s]" % (sys.argv[0], "|".join(sorted(MODES))))
+    MODES[mode]()
@@ -9,6 +9,7 @@ import sys
 from oaipmh.client import Client
 #from oaipmh.common import Identify, Metadata, Header
 from oaipmh.metadata import MetadataRegistry, MetadataReader
+from nsdl.transform import Transformer
 
 class NSDLDCImport(object):
     '''
@@ -30,6 +31,7 @@ class NSDLDCImport(object):
             self._fieldMap = nsdl.NSDL_TO_LR_MAP
         else:
             self._fieldMap = fieldMap
+        self._transform = Transformer(self._fieldMap)
         
         if namespaces == None:
             self._namespaces = nsdl.LR_NSDL_DC_NAMESPACES
@@ -46,36 +48,16 @@ class NSDLDCImport(object):
         self._client = Client(url, self._registry)
     
     def _format(self, doc):
-        value = {}
-        # merge all the fields
-        for (fieldname, fieldconfig) in self._fieldMap.items():
-            if fieldconfig["type"] == "const" and "const" in fieldconfig:
-                value[fieldname] = fieldconfig["const"]
-            elif fieldconfig["type"] == "[string]" and len(fieldconfig["fields"]) > 0:
-                value[fieldname] = []
-                for field in fieldconfig["fields"]:
-                    value[fieldname].extend(doc.getField(field))
-            elif fieldconfig["type"] == "string" and len(fieldconfig["fields"]) > 0:
-                value[fieldname] = ""
-                for field in fieldconfig["fields"]:
-                    value[fieldname] += ", ".join(doc.getField(field))
-            elif fieldconfig["type"] == "boolean" and len(fieldconfig["fields"]) > 0:
-                value[fieldname] = True
-                for field in fieldconfig["fields"]:
-                    value[fieldname] &= doc.getField(field)
-        return value
+        return self._transform(doc)
     
     def fetch_documents(self, range=10000):
         
-        return_stuff = []
+        records = []
         for record in self._client.listRecords(metadataPrefix=self._prefix):
-            r = record[1]
-            value = self._format(r)
-            if value != None:
-                return_stuff.append(value)
-            if len(return_stuff) >= range:
-                yield return_stuff     
-                return_stuff = []
+            records.append(record[1])
+            if len(records) >= range:
+                yield self._transform.batch(records)
+                records = []
     
     
 
@@ -0,0 +1,95 @@
+'''
+Turns harvested metadata records into Learning Registry documents by way of
+a field map such as nsdl.NSDL_TO_LR_MAP.
+
+The field map is compiled once into a list of (name, extractor) pairs, one
+closure per field specialized on the field's type and source fields. Entries
+that would never produce a value, those without source fields other than
+constants, are left out, so formatting a record only does the work of the
+fields it actually fills.
+'''
+
+def _const(const):
+    def extract(doc):
+        return const
+    return extract
+
+def _stringList(fields):
+    if len(fields) == 1:
+        field = fields[0]
+        def extract(doc):
+            return list(doc.getField(field))
+        return extract
+    def extract(doc):
+        value = []
+        for field in fields:
+            value.extend(doc.getField(field))
+        return value
+    return extract
+
+def _string(fields):
+    if len(fields) == 1:
+        field = fields[0]
+        def extract(doc):
+            return ", ".join(doc.getField(field))
+        return extract
+    def extract(doc):
+        value = ""
+        for field in fields:
+            value += ", ".join(doc.getField(field))
+        return value
+    return extract
+
+def _boolean(fields):
+    def extract(doc):
+        value = True
+        for field in fields:
+            value &= doc.getField(field)
+        return value
+    return extract
+
+_COMPILERS = {
+    "[string]": _stringList,
+    "string": _string,
+    "boolean": _boolean,
+}
+
+def compileFieldMap(fieldMap):
+    '''
+    Returns the (fieldname, extractor) pairs of a field map, extractor being
+    a function of a record returning the field's value.
+    '''
+    compiled = []
+    for (fieldname, fieldconfig) in fieldMap.items():
+        if fieldconfig["type"] == "const":
+            if "const" in fieldconfig:
+                compiled.append((fieldname, _const(fieldconfig["const"])))
+        elif fieldconfig["type"] in _COMPILERS and len(fieldconfig["fields"]) > 0:
+            fields = tuple(fieldconfig["fields"])
+            compiled.append((fieldname, _COMPILERS[fieldconfig["type"]](fields)))
+    return compiled
+
+class Transformer(object):
+    '''
+    Formats records, anything with a getField(name) method like an oaipmh
+    Metadata, into documents according to a field map.
+    '''
+    def __init__(self, fieldMap):
+        self._extractors = compileFieldMap(fieldMap)
+
+    def __call__(self, doc):
+        value = {}
+        for (fieldname, extract) in self._extractors:
+            value[fieldname] = extract(doc)
+        return value
+
+    def batch(self, docs):
+        '''Formats a list of records, returns the list of documents.'''
+        extractors = self._extractors
+        values = []
+        for doc in docs:
+            value = {}
+            for (fieldname, extract) in extractors:
+                value[fieldname] = extract(doc)
+            values.append(value)
+        return values
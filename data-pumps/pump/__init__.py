@@ -0,0 +1,3 @@
+'''
+Building blocks shared by the data pumps.
+'''
@@ -0,0 +1,53 @@
+'''
+Remembers how far each OAI-PMH harvest got, so the next run only asks for
+records created or changed since.
+
+The checkpoint file is a JSON object keyed by endpoint, metadata prefix and
+set. It is rewritten through a temporary file and a rename, so a pump killed
+while saving leaves the previous checkpoint intact.
+'''
+import json
+import os
+import threading
+
+def checkpointKey(conf):
+    return "%s%s|%s|%s" % (conf["server"], conf["path"], conf["metadataPrefix"], conf.get("set") or "")
+
+def harvestFrom(responseDate, granularity="YYYY-MM-DDThh:mm:ssZ"):
+    '''The from argument for a harvest following one that began at responseDate.'''
+    if granularity == "YYYY-MM-DD":
+        return responseDate[:10]
+    return responseDate
+
+class Checkpoint(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                self._data = json.load(f)
+            finally:
+                f.close()
+
+    def get(self, key):
+        '''Returns {"responseDate": ..., "datestamp": ...} or None.'''
+        return self._data.get(key)
+
+    def set(self, key, responseDate, datestamp=None):
+        self._lock.acquire()
+        try:
+            self._data[key] = { "responseDate": responseDate, "datestamp": datestamp }
+            self._save()
+        finally:
+            self._lock.release()
+
+    def _save(self):
+        tmp = "%s.tmp" % self.path
+        f = open(tmp, "w")
+        try:
+            json.dump(self._data, f, indent=4, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
@@ -0,0 +1,270 @@
+'''
+Fetches ListRecords pages from OAI-PMH endpoints.
+
+Requests to a host go through that host's token bucket, and a 503 with
+Retry-After only pauses the bucket of the host that sent it. Each endpoint is
+harvested on its own thread, so a throttled repository holds back its own
+harvest and no other.
+'''
+import logging
+import sys
+import threading
+import time
+import urllib2
+import urlparse
+from urllib import urlencode
+
+from pump import oai
+
+log = logging.getLogger(__name__)
+
+WAIT_DEFAULT = 120 # two minutes
+WAIT_MAX = 5
+
+# sent to every OAI-PMH server, so repository operators can tell the pump apart
+USER_AGENT = "LearningRegistry-data-pump/1.0 Python-urllib/%s" % urllib2.__version__
+
+class Error(Exception):
+    pass
+
+class Harvest(object):
+    '''
+    One endpoint, set and metadata format to harvest, and how the run went:
+    the responseDate of its first page, the latest datestamp seen, whether
+    every page was fetched, how many documents failed to publish and how
+    many pages a pipeline stage dropped. A checkpoint should only move after
+    a complete, clean run.
+
+    records and bytesIn count what was fetched so far, completeListSize is
+    the size of the whole list when the server tells.
+    '''
+    def __init__(self, conf):
+        self.conf = conf
+        self.format = oai.FORMATS[conf["metadataPrefix"]]
+        self.responseDate = None
+        self.datestamp = None
+        self.complete = False
+        self.publishFailures = 0
+        self.stageFailures = 0
+        self.records = 0
+        self.bytesIn = 0
+        self.completeListSize = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "%s%s %s %s" % (self.conf["server"], self.conf["path"],
+                               self.conf["metadataPrefix"], self.conf.get("set") or "")
+
+    def stageFailed(self):
+        '''Counts a page of this harvest dropped by a failing pipeline stage.'''
+        self._lock.acquire()
+        try:
+            self.stageFailures += 1
+        finally:
+            self._lock.release()
+
+    def clean(self):
+        return self.complete and not self.publishFailures and not self.stageFailures
+
+    def sawPage(self, page):
+        if self.responseDate is None:
+            self.responseDate = page.responseDate
+        self.records += len(page.records)
+        self.bytesIn += page.bytes
+        if page.completeListSize is not None:
+            self.completeListSize = page.completeListSize
+        for record in page.records:
+            if record.datestamp and record.datestamp > self.datestamp:
+                self.datestamp = record.datestamp
+
+class TokenBucket(object):
+    '''Allows rate requests per second on average and up to burst at once.'''
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._notBefore = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            self._lock.acquire()
+            try:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if now < self._notBefore:
+                    wait = self._notBefore - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            finally:
+                self._lock.release()
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        '''Lets no request through for seconds, as asked by a Retry-After.'''
+        self._lock.acquire()
+        try:
+            self._notBefore = max(self._notBefore, time.time() + seconds)
+            self._tokens = 0
+        finally:
+            self._lock.release()
+
+class HostLimiter(object):
+    '''
+    A token bucket per host. rates maps a host name to its (rate, burst),
+    other hosts get the default rate and burst.
+    '''
+    def __init__(self, rate=1.0, burst=1, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse.urlsplit(url)[1]
+        self._lock.acquire()
+        try:
+            if host not in self._buckets:
+                rate, burst = self.rates.get(host, (self.rate, self.burst))
+                self._buckets[host] = TokenBucket(rate, burst)
+            return self._buckets[host]
+        finally:
+            self._lock.release()
+
+def makeRequest(base_url, credentials=None, limiter=None, **kw):
+    """Open the XML response of the server, as a file-like object.
+    """
+    # XXX include From header?
+    headers = {'User-Agent': USER_AGENT}
+    if credentials is not None:
+        headers['Authorization'] = 'Basic ' + credentials.strip()
+    request = urllib2.Request(
+        base_url, data=urlencode(kw), headers=headers)
+    if limiter is None:
+        limiter = HostLimiter()
+    return retrieveFromUrlWaiting(request, limiter.bucket(base_url))
+
+def retrieveFromUrlWaiting(request, bucket,
+                           wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT):
+    """Open URL, handling 503 Retry-After.
+    """
+    for i in range(wait_max):
+        bucket.acquire()
+        try:
+            f = urllib2.urlopen(request)
+            # we successfully opened without having to wait
+            break
+        except urllib2.HTTPError, e:
+            if e.code == 503:
+                try:
+                    retryAfter = int(e.hdrs.get('Retry-After'))
+                except (TypeError, ValueError):
+                    retryAfter = None
+                if retryAfter is None:
+                    bucket.pause(wait_default)
+                else:
+                    bucket.pause(retryAfter)
+            else:
+                # reraise any other HTTP error
+                raise
+    else:
+        raise Error, "Waited too often (more than %s times)" % wait_max
+    return f
+
+class _CountingStream(object):
+    def __init__(self, f):
+        self._f = f
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.count += len(data)
+        return data
+
+def fetchPage(base_url, handler, limiter=None, **kw):
+    '''
+    Fetches and parses one ListRecords page, streaming the response into the
+    parser.
+    '''
+    f = makeRequest(base_url, limiter=limiter, **kw)
+    try:
+        stream = _CountingStream(f)
+        page = oai.parseListRecords(stream, handler)
+        page.bytes = stream.count
+        return page
+    finally:
+        f.close()
+
+def fetchRecords(harvest, limiter=None, handler=None):
+    '''
+    Generator yielding (harvest, records) for every page of a harvest, using
+    a resumptionToken if supplied. Harvests records changed between
+    conf["from"] and conf["until"] when set. handler turns each oai:record
+    element into a record, by default the Record of the harvest's format.
+    '''
+    conf = harvest.conf
+    url = "%s%s" % (conf["server"], conf["path"])
+    verb = conf["verb"]
+    set = conf.get("set")
+    if handler is None:
+        handler = harvest.format.extract
+
+    params = { "verb": verb, "metadataPrefix": conf["metadataPrefix"] }
+    if set != None:
+        params["set"] = set
+    if conf.get("from"):
+        params["from"] = conf["from"]
+    if conf.get("until"):
+        params["until"] = conf["until"]
+
+    page = fetchPage(url, handler, limiter, **params)
+    harvest.sawPage(page)
+    if page.errorCode == "noRecordsMatch":
+        # nothing changed since the last harvest
+        harvest.complete = True
+        return
+    if page.errorCode is not None:
+        log.error("%s: OAI-PMH error %s: %s", harvest, page.errorCode, page.error)
+        return
+    yield harvest, page.records
+
+    # the resumptionToken replaces every other argument
+    params = { "verb": verb }
+
+    while page.resumptionToken is not None:
+        try:
+            params["resumptionToken"] = page.resumptionToken
+            page = fetchPage(url, handler, limiter, **params)
+            if page.errorCode is not None:
+                raise Error("OAI-PMH error %s: %s" % (page.errorCode, page.error))
+            harvest.sawPage(page)
+            yield harvest, page.records
+        except Exception as e:
+            log.error(sys.exc_info())
+            log.exception("%s: Problem trying to get next segment.", harvest)
+            return
+    harvest.complete = True
+
+def fetchAll(harvests, limiter=None, concurrency=4, handler=None):
+    '''
+    One fetchRecords source per harvest, of which at most concurrency are
+    fetching at any time. Feed them all to Pipeline.run.
+    '''
+    slots = threading.BoundedSemaphore(concurrency)
+    def source(harvest):
+        slots.acquire()
+        try:
+            try:
+                for item in fetchRecords(harvest, limiter, handler):
+                    yield item
+            except Exception:
+                log.exception("%s: harvest failed", harvest)
+        finally:
+            slots.release()
+    return [source(harvest) for harvest in harvests]
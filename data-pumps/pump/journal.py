@@ -0,0 +1,94 @@
+'''
+Remembers what a pump has published, so a run does not publish the same
+envelopes again.
+
+The journal is a sqlite database mapping the OAI identifier of a record to
+the content hash of the last envelope the node accepted, and to the doc_ID
+of its latest content. An envelope whose hash matches is unchanged and is
+skipped. The hash is only stored once the node has accepted the envelope,
+so an envelope that failed to publish is tried again on the next run, under
+the doc_ID it was first given; should the earlier attempt have landed after
+all, the node's conflict on that doc_ID tells the publisher it is stored.
+
+A node saves resource data documents under their doc_ID and cannot update
+one in place, so a changed record is published under a new doc_ID. The
+envelope of its earlier content stays on the node.
+'''
+import hashlib
+import json
+import sqlite3
+import threading
+import uuid
+
+def contentHash(doc):
+    '''Hash of an envelope, leaving out its doc_ID.'''
+    doc = dict(doc)
+    doc.pop("doc_ID", None)
+    return hashlib.sha1(json.dumps(doc, sort_keys=True)).hexdigest()
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # doc_ID was given to the content hashed as assigned, hash is the
+        # content the node last accepted
+        self._db.execute('''CREATE TABLE IF NOT EXISTS records (
+                                identifier TEXT PRIMARY KEY,
+                                doc_ID TEXT NOT NULL UNIQUE,
+                                hash TEXT,
+                                assigned TEXT)''')
+        self._db.commit()
+
+    def filter(self, identifiers, docs):
+        '''
+        Returns the docs that changed since they were last published, with
+        their doc_ID set. identifiers are the OAI identifiers of the docs;
+        docs without one are always returned, without a doc_ID.
+        '''
+        changed = []
+        self._lock.acquire()
+        try:
+            for identifier, doc in zip(identifiers, docs):
+                if identifier is None:
+                    changed.append(doc)
+                    continue
+                row = self._db.execute("SELECT doc_ID, hash, assigned FROM records WHERE identifier = ?",
+                                       (identifier,)).fetchone()
+                digest = contentHash(doc)
+                if row is None:
+                    docID = uuid.uuid4().hex
+                    self._db.execute("INSERT INTO records (identifier, doc_ID, assigned) VALUES (?, ?, ?)",
+                                     (identifier, docID, digest))
+                elif row[1] == digest:
+                    self.skipped += 1
+                    continue
+                elif row[2] == digest:
+                    # this content was sent before without being confirmed
+                    docID = row[0]
+                else:
+                    docID = uuid.uuid4().hex
+                    self._db.execute("UPDATE records SET doc_ID = ?, assigned = ? WHERE identifier = ?",
+                                     (docID, digest, identifier))
+                doc["doc_ID"] = docID
+                changed.append(doc)
+            self._db.commit()
+        finally:
+            self._lock.release()
+        return changed
+
+    def published(self, docs):
+        '''Records docs as accepted by the node, a Publisher onPublished callback.'''
+        self._lock.acquire()
+        try:
+            for doc in docs:
+                if "doc_ID" in doc:
+                    self._db.execute("UPDATE records SET hash = ? WHERE doc_ID = ?",
+                                     (contentHash(doc), doc["doc_ID"]))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,190 @@
+'''
+Streaming OAI-PMH ListRecords parsing and record to envelope formatting.
+
+A ListRecords response is parsed with iterparse straight off the network
+stream: each oai:record is handed to a callback as soon as it is complete and
+is then cleared, so only one record of a page is ever held as a tree. The
+fields of a record are pulled with XPath expressions compiled once per
+metadata format.
+'''
+from lxml import etree
+
+NAMESPACES = {
+              "oai" : "http://www.openarchives.org/OAI/2.0/",
+              "oai_dc" : "http://www.openarchives.org/OAI/2.0/oai_dc/",
+              "dc":"http://purl.org/dc/elements/1.1/",
+              "dct":"http://purl.org/dc/terms/",
+              "nsdl_dc":"http://ns.nsdl.org/nsdl_dc_v1.02/",
+              "ieee":"http://www.ieee.org/xsd/LOMv1p0",
+              "xsi":"http://www.w3.org/2001/XMLSchema-instance"
+              }
+
+_OAI = "{%s}" % NAMESPACES["oai"]
+_RECORD = _OAI + "record"
+
+_responseDate = etree.XPath("oai:responseDate/text()", namespaces=NAMESPACES)
+_error = etree.XPath("oai:error", namespaces=NAMESPACES)
+_resumptionToken = etree.XPath("oai:ListRecords/oai:resumptionToken", namespaces=NAMESPACES)
+_identifier = etree.XPath("oai:header/oai:identifier/text()", namespaces=NAMESPACES)
+_datestamp = etree.XPath("oai:header/oai:datestamp/text()", namespaces=NAMESPACES)
+
+def getDocTemplate():
+    return {
+            "doc_type": "resource_data",
+            "doc_version": "0.10.0",
+            "resource_data_type" : "metadata",
+            "active" : True,
+            "submitter_type": "agent",
+            "submitter": "NSDL 2 LR Data Pump",
+            "submission_TOS": "Yes",
+            "resource_locator": None,
+            "filtering_keys": [],
+            "payload_placement": None,
+            "payload_schema": [],
+            "payload_schema_locator":[],
+            "payload_locator": None,
+            "resource_data": None
+            }
+
+class Record(object):
+    '''The fields of an oai:record that an envelope is made of.'''
+    __slots__ = ("identifier", "datestamp", "locator", "keys", "payload")
+
+    def __init__(self, identifier, datestamp, locator, keys, payload):
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.locator = locator
+        self.keys = keys
+        self.payload = payload
+
+class Format(object):
+    '''
+    A metadata format: where its payload, locator and filtering keys are
+    found in a record, and the schema the envelope declares.
+    '''
+    def __init__(self, prefix, root, keys, schema, schemaLocator):
+        self.prefix = prefix
+        self.schema = schema
+        self.schemaLocator = schemaLocator
+        self._payload = etree.XPath("oai:metadata/%s" % root, namespaces=NAMESPACES)
+        self._locator = etree.XPath("dc:identifier/text()", namespaces=NAMESPACES)
+        self._keys = [etree.XPath("%s/text()" % key, namespaces=NAMESPACES) for key in keys]
+
+    def extract(self, record):
+        '''
+        Returns the Record of an oai:record element, None for a record
+        without metadata such as a deleted one.
+        '''
+        payload = self._payload(record)
+        if not payload:
+            return None
+        payload = payload[0]
+        keys = []
+        for xpath in self._keys:
+            keys.extend(xpath(payload))
+        identifier = _identifier(record)
+        datestamp = _datestamp(record)
+        return Record(identifier and identifier[0] or None,
+                      datestamp and datestamp[0] or None,
+                      self._locator(payload), keys, etree.tostring(payload))
+
+    def envelope(self, record):
+        doc = getDocTemplate()
+        doc["resource_locator"] = record.locator
+        doc["filtering_keys"].extend(record.keys)
+        doc["payload_schema"].append(self.schema)
+        doc["payload_schema_locator"].append(self.schemaLocator)
+        doc["payload_placement"] = "inline"
+        doc["resource_data"] = record.payload
+
+        for key in doc.keys():
+            if (doc[key] == None):
+                del doc[key]
+
+        return doc
+
+    def formatRecord(self, record):
+        '''Envelope of an oai:record element, None if it has no metadata.'''
+        extracted = self.extract(record)
+        if extracted is None:
+            return None
+        return self.envelope(extracted)
+
+class RawRecord(object):
+    '''
+    An oai:record kept as serialized XML, to be formatted elsewhere, with
+    the header fields a harvest keeps track of.
+    '''
+    __slots__ = ("identifier", "datestamp", "xml")
+
+    def __init__(self, identifier, datestamp, xml):
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.xml = xml
+
+def serializeRecord(record):
+    '''Handler for parseListRecords returning RawRecords.'''
+    identifier = _identifier(record)
+    datestamp = _datestamp(record)
+    return RawRecord(identifier and identifier[0] or None,
+                     datestamp and datestamp[0] or None,
+                     etree.tostring(record))
+
+FORMATS = {
+    "oai_dc": Format("oai_dc", "oai_dc:dc",
+                     ["dc:subject", "dc:language"],
+                     "OAI DC 2.0",
+                     "http://www.openarchives.org/OAI/2.0/oai_dc/ http://www.openarchives.org/OAI/2.0/oai_dc.xsd"),
+    "nsdl_dc": Format("nsdl_dc", "nsdl_dc:nsdl_dc",
+                      ["dc:subject", "dc:language", "dct:educationLevel"],
+                      "NSDL DC 1.02.020",
+                      "http://ns.nsdl.org/nsdl_dc_v1.02/ http://ns.nsdl.org/schemas/nsdl_dc/nsdl_dc_v1.02.xsd"),
+}
+
+class Page(object):
+    '''One ListRecords response.'''
+    def __init__(self):
+        self.records = []
+        self.resumptionToken = None
+        self.completeListSize = None
+        self.cursor = None
+        self.responseDate = None
+        self.errorCode = None
+        self.error = None
+        self.bytes = 0
+
+def parseListRecords(stream, handler):
+    '''
+    Parses a ListRecords response from a file-like stream. handler is called
+    with each oai:record element and its non-None results are collected in
+    the records of the returned Page.
+    '''
+    page = Page()
+    context = etree.iterparse(stream, events=("end",), tag=_RECORD)
+    for event, elem in context:
+        result = handler(elem)
+        if result is not None:
+            page.records.append(result)
+        # drop the record and the records before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    root = context.root
+    responseDate = _responseDate(root)
+    if responseDate:
+        page.responseDate = responseDate[0].strip()
+    error = _error(root)
+    if error:
+        page.errorCode = error[0].get("code")
+        page.error = error[0].text
+    token = _resumptionToken(root)
+    if token:
+        token = token[0]
+        if token.text and token.text.strip():
+            page.resumptionToken = token.text.strip()
+        if token.get("completeListSize"):
+            page.completeListSize = int(token.get("completeListSize"))
+        if token.get("cursor"):
+            page.cursor = int(token.get("cursor"))
+    return page
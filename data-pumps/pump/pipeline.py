@@ -0,0 +1,134 @@
+'''
+Runs the stages of a data pump concurrently.
+
+Each stage runs in its own threads and hands its results to the next stage
+through a bounded queue, so while one page of records is being published the
+next is being transformed and the one after that fetched. The wall time of a
+pump then approaches that of its slowest stage rather than the sum of all of
+them, and the bounded queues keep a fast stage from running away from a slow
+one.
+'''
+import logging
+import threading
+import Queue
+
+log = logging.getLogger(__name__)
+
+_END = object()
+
+class Stage(object):
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = None
+        self.output = None
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._running = workers
+
+    def _count(self, failed):
+        self._lock.acquire()
+        try:
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+        finally:
+            self._lock.release()
+
+    def _finish(self):
+        '''Returns True for the last worker of the stage to finish.'''
+        self._lock.acquire()
+        try:
+            self._running -= 1
+            return self._running == 0
+        finally:
+            self._lock.release()
+
+    def work(self):
+        while True:
+            item = self.input.get()
+            if item is _END:
+                # let the other workers of this stage see the end too
+                self.input.put(_END)
+                break
+            try:
+                result = self.func(item)
+            except Exception:
+                log.exception("Stage %s failed, dropping its input", self.name)
+                self._count(True)
+                continue
+            self._count(False)
+            if result is not None and self.output is not None:
+                self.output.put(result)
+        if self._finish() and self.output is not None:
+            self.output.put(_END)
+
+class Pipeline(object):
+    '''
+    Feeds the items of one or more source iterators through a chain of stages.
+
+    A stage is a function taking one item and returning the item to hand to
+    the next stage, or None to drop it. Exceptions raised by a stage are
+    logged and the item is dropped. With more than one worker a stage
+    may reorder its items.
+    '''
+    def __init__(self, queueSize=2):
+        self.queueSize = queueSize
+        self.stages = []
+        self.fetched = 0
+        self._lock = threading.Lock()
+        self._sources = 0
+
+    def addStage(self, name, func, workers=1):
+        stage = Stage(name, func, workers)
+        stage.input = Queue.Queue(self.queueSize)
+        if self.stages:
+            self.stages[-1].output = stage.input
+        self.stages.append(stage)
+        return stage
+
+    def queueDepths(self):
+        return [(stage.name, stage.input.qsize()) for stage in self.stages]
+
+    def _fetch(self, source):
+        try:
+            for item in source:
+                self._lock.acquire()
+                self.fetched += 1
+                self._lock.release()
+                self.stages[0].input.put(item)
+        except Exception:
+            log.exception("Source failed, ending it")
+        self._lock.acquire()
+        try:
+            self._sources -= 1
+            last = self._sources == 0
+        finally:
+            self._lock.release()
+        if last:
+            self.stages[0].input.put(_END)
+
+    def run(self, *sources):
+        '''
+        Runs the pipeline until every source is exhausted and drained. Each
+        source is read from its own thread.
+        '''
+        self._sources = len(sources)
+        if not sources and self.stages:
+            # nothing to fetch, end the stages straight away
+            self.stages[0].input.put(_END)
+        threads = [threading.Thread(target=self._fetch, args=(source,), name="fetch")
+                   for source in sources]
+        for stage in self.stages:
+            for i in range(stage.workers):
+                threads.append(threading.Thread(target=stage.work, name=stage.name))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            # join with a timeout so KeyboardInterrupt still reaches us
+            while thread.isAlive():
+                thread.join(1)
@@ -0,0 +1,122 @@
+'''
+Periodic progress reports of a running pump.
+
+A Progress logs a line of key=value pairs every interval seconds: records
+fetched, formatted and published and their rates over the last interval,
+bytes fetched and published, the depth of the queues between pipeline stages
+and, when the OAI servers give a completeListSize, the estimated time left
+to fetch everything. A last line with the averages over the whole run is
+logged on stop().
+
+It reads the counters the harvests, pipeline and publisher keep anyway;
+the pump adds its own, such as documents formatted or written, with add().
+'''
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# counters reported with their rate
+RATES = ("fetched", "formatted", "written", "published", "bytesIn", "bytesOut")
+
+def formatDuration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+class Progress(object):
+    def __init__(self, interval=10.0, harvests=None, pipeline=None, publisher=None):
+        self.interval = interval
+        self.harvests = harvests
+        self.pipeline = pipeline
+        self.publisher = publisher
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = None
+        self._last = None
+
+    def add(self, name, n=1):
+        self._lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + n
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        '''The current value of every counter, by name.'''
+        self._lock.acquire()
+        try:
+            values = dict(self.counters)
+        finally:
+            self._lock.release()
+        if self.harvests is not None:
+            values["fetched"] = sum([harvest.records for harvest in self.harvests])
+            values["bytesIn"] = sum([harvest.bytesIn for harvest in self.harvests])
+        if self.publisher is not None:
+            values["published"] = self.publisher.published
+            values["failed"] = self.publisher.failed
+            values["bytesOut"] = self.publisher.bytesOut
+        return values
+
+    def remaining(self):
+        '''Records left to fetch, None unless a harvest gave a completeListSize.'''
+        if not self.harvests:
+            return None
+        left = None
+        for harvest in self.harvests:
+            if harvest.complete or harvest.completeListSize is None:
+                continue
+            left = (left or 0) + max(0, harvest.completeListSize - harvest.records)
+        return left
+
+    def report(self, since=None, queues=True):
+        '''
+        A key=value line of the counters, with rates over the time since the
+        snapshot since, a (time, values) pair, and the new snapshot.
+        '''
+        now = time.time()
+        values = self.snapshot()
+        if since is None:
+            since = (self._started or now, {})
+        elapsed = max(now - since[0], 1e-6)
+        fields = []
+        for name in sorted(values):
+            fields.append("%s=%d" % (name, values[name]))
+            if name in RATES:
+                rate = (values[name] - since[1].get(name, 0)) / elapsed
+                fields.append("%sRate=%.1f/s" % (name, rate))
+        if queues and self.pipeline is not None:
+            fields.append("queues=%s" % ",".join(["%s:%d" % depth for depth in self.pipeline.queueDepths()]))
+        left = self.remaining()
+        if left is not None:
+            rate = (values["fetched"] - since[1].get("fetched", 0)) / elapsed
+            if rate > 0:
+                fields.append("eta=%s" % formatDuration(left / rate))
+            fields.append("remaining=%d" % left)
+        fields.append("elapsed=%s" % formatDuration(now - (self._started or now)))
+        return " ".join(fields), (now, values)
+
+    def start(self):
+        self._started = time.time()
+        self._last = (self._started, {})
+        self._thread = threading.Thread(target=self._run, name="progress")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.isSet():
+                break
+            line, self._last = self.report(self._last)
+            log.info("progress %s", line)
+
+    def stop(self):
+        '''Stops the reports and logs the averages over the whole run.'''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        line, self._last = self.report(queues=False)
+        log.info("done %s", line)
@@ -0,0 +1,261 @@
+'''
+Publishes envelopes to a Learning Registry node's /publish service.
+
+Documents are queued with publish() and posted in batches by a few sender
+threads, each keeping its own persistent HTTP connection, so several batches
+can be in flight at once. The batch size adapts to the node: it grows while
+responses come back faster than targetLatency and is halved when they are
+slower or a batch fails. A batch that fails with a connection error or a 5xx
+response is retried with exponential backoff. Once its retries are used up,
+or straight away when the node answers with another error status, it is
+appended to a dead letter file, one JSON {"documents": [...]} body per line,
+from which it can be published again later.
+
+Documents can be published with a tag, such as the harvest they come from;
+failedBy counts the documents of each tag that were dead lettered or rejected.
+onPublished, when given, is called from the sender threads with the list of
+documents of each batch that the node accepted.
+
+A document sent with a doc_ID that the node rejects with a conflict is
+already stored under that doc_ID, typically by an earlier attempt whose
+response was lost, and is counted as published.
+'''
+import httplib
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import urlparse
+import Queue
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+class PublishError(Exception):
+    def __init__(self, message, status):
+        Exception.__init__(self, message)
+        self.status = status
+
+def _retryable(error):
+    '''Whether a failed post may succeed when it is sent again.'''
+    if isinstance(error, PublishError):
+        return error.status >= 500
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+def _alreadyStored(doc, status):
+    '''Whether a rejection says the document's own doc_ID is already saved.'''
+    return bool(doc.get("doc_ID")) and "conflict" in str(status.get("error", "")).lower()
+
+class Publisher(object):
+    def __init__(self, url, inFlight=2, batchSize=100, minBatchSize=10,
+                 maxBatchSize=1000, targetLatency=5.0, retries=3, backoff=1.0,
+                 deadLetterPath=None, timeout=120, onPublished=None):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts[0]
+        self.netloc = parts[1]
+        self.path = parts[2].rstrip("/") + "/publish"
+        self.inFlight = inFlight
+        self.batchSize = batchSize
+        self.minBatchSize = minBatchSize
+        self.maxBatchSize = maxBatchSize
+        self.targetLatency = targetLatency
+        self.retries = retries
+        self.backoff = backoff
+        self.deadLetterPath = deadLetterPath
+        self.timeout = timeout
+        self.onPublished = onPublished
+
+        self.published = 0
+        self.failed = 0
+        self.failedBy = {}
+        self.bytesOut = 0
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._batches = Queue.Queue(inFlight)
+        self._threads = []
+        for i in range(inFlight):
+            thread = threading.Thread(target=self._send, name="publisher-%d" % i)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def publish(self, docs, tag=None):
+        '''
+        Queues documents for publishing. Blocks while every sender is busy,
+        which is what keeps a fast pump from running ahead of the node.
+        '''
+        self._lock.acquire()
+        try:
+            self._pending.extend([(tag, doc) for doc in docs])
+            batches = []
+            while len(self._pending) >= self.batchSize:
+                batches.append(self._pending[:self.batchSize])
+                del self._pending[:self.batchSize]
+        finally:
+            self._lock.release()
+        for batch in batches:
+            self._batches.put(batch)
+
+    def flush(self):
+        '''
+        Sends what is still queued and waits until every batch has been
+        published or dead lettered.
+        '''
+        self._queuePending()
+        done = self._batches.all_tasks_done
+        done.acquire()
+        try:
+            # wait with a timeout so KeyboardInterrupt still reaches us
+            while self._batches.unfinished_tasks:
+                done.wait(1)
+        finally:
+            done.release()
+
+    def close(self):
+        '''Sends what is still queued and waits for every batch to finish.'''
+        self._queuePending()
+        for thread in self._threads:
+            self._batches.put(_STOP)
+        for thread in self._threads:
+            while thread.isAlive():
+                thread.join(1)
+
+    def _queuePending(self):
+        self._lock.acquire()
+        try:
+            batch = self._pending
+            self._pending = []
+        finally:
+            self._lock.release()
+        if batch:
+            self._batches.put(batch)
+
+    def _connect(self):
+        if self.scheme == "https":
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _post(self, connection, body):
+        '''Posts one body, returns the parsed response of the node.'''
+        connection.request("POST", self.path, body,
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise PublishError("HTTP %d: %s" % (response.status, data[:200]),
+                               response.status)
+        return json.loads(data)
+
+    def _send(self):
+        connection = self._connect()
+        while True:
+            batch = self._batches.get()
+            if batch is _STOP:
+                self._batches.task_done()
+                break
+            try:
+                connection = self._sendBatch(connection, batch)
+            except Exception:
+                # the sender must outlive the batch, flush() and close()
+                # wait for every batch to be marked done
+                log.exception("Sending a batch of %d documents failed", len(batch))
+            finally:
+                self._batches.task_done()
+        connection.close()
+
+    def _sendBatch(self, connection, batch):
+        '''Publishes one batch, returns the connection to send the next one on.'''
+        body = json.dumps({ "documents": [doc for tag, doc in batch] })
+        for attempt in range(self.retries + 1):
+            started = time.time()
+            try:
+                result = self._post(connection, body)
+            except Exception, e:
+                # the connection may be half used, start over with a new one
+                connection.close()
+                connection = self._connect()
+                self._adapt(None)
+                if attempt == self.retries or not _retryable(e):
+                    log.error("Giving up on a batch of %d documents: %s", len(batch), e)
+                    try:
+                        self._deadLetter(body, batch)
+                    except (IOError, OSError):
+                        log.exception("Could not dead letter a batch of %d documents", len(batch))
+                    break
+                delay = self.backoff * 2 ** attempt
+                log.warning("Publishing a batch of %d documents failed (%s), retrying in %.1fs",
+                            len(batch), e, delay)
+                time.sleep(delay * (0.5 + random.random()))
+                continue
+            self._adapt(time.time() - started)
+            self._count(batch, body, result)
+            break
+        return connection
+
+    def _fail(self, tag):
+        self.failed += 1
+        self.failedBy[tag] = self.failedBy.get(tag, 0) + 1
+
+    def _count(self, batch, body, result):
+        # document_results are in the order the documents were sent
+        rejected = 0
+        accepted = [doc for tag, doc in batch]
+        self._lock.acquire()
+        try:
+            for i, ((tag, doc), status) in enumerate(zip(batch, result.get("document_results", []))):
+                if not status.get("OK") and not _alreadyStored(doc, status):
+                    rejected += 1
+                    accepted[i] = None
+                    self._fail(tag)
+            self.published += len(batch) - rejected
+            self.bytesOut += len(body)
+        finally:
+            self._lock.release()
+        if rejected:
+            log.warning("%d of %d documents were rejected by the node", rejected, len(batch))
+        if self.onPublished is not None:
+            try:
+                self.onPublished([doc for doc in accepted if doc is not None])
+            except Exception:
+                log.exception("onPublished failed")
+
+    def _adapt(self, latency):
+        '''Grows the batch size additively, shrinks it by half on slowness or failure.'''
+        self._lock.acquire()
+        try:
+            if latency is not None and latency < self.targetLatency:
+                self.batchSize = min(self.maxBatchSize, self.batchSize + self.minBatchSize)
+            else:
+                self.batchSize = max(self.minBatchSize, self.batchSize / 2)
+        finally:
+            self._lock.release()
+
+    def _deadLetter(self, body, batch):
+        self._lock.acquire()
+        try:
+            for tag, doc in batch:
+                self._fail(tag)
+            if self.deadLetterPath is None:
+                return
+            f = open(self.deadLetterPath, "a")
+            try:
+                f.write(body)
+                f.write("\n")
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+def replayDeadLetters(path, publisher):
+    '''Publishes the batches of a dead letter file again.'''
+    f = open(path)
+    try:
+        for line in f:
+            if line.strip():
+                publisher.publish(json.loads(line)["documents"])
+    finally:
+        f.close()
@@ -0,0 +1,141 @@
+'''
+Envelopes spooled to disk between harvesting and publishing.
+
+A harvest writes its envelopes, one JSON document per line, to gzip
+compressed segment files in a directory, starting a new segment every
+maxDocs documents. A segment is written under a .part name and renamed once
+complete, so a reader only ever sees whole segments. Segments are numbered
+on from the last one in the directory, and sort in the order they were
+written.
+
+A segment that fails to be written may end in a partial line and holds
+documents of several harvests, so it is set aside under a .failed name and
+failed is set; no harvest of the run should be taken as written.
+
+Publishing reads the segments back in order and records how far it got in an
+offset file, the segment name and the number of lines of it published, so a
+publish that is stopped resumes where it left off.
+'''
+import gzip
+import json
+import os
+import re
+
+_SEGMENT = re.compile(r"^segment-(\d+)\.ndjson\.gz$")
+# complete, partial and failed segments alike
+_ANY_SEGMENT = re.compile(r"^segment-(\d+)\.")
+
+def segmentName(number):
+    return "segment-%06d.ndjson.gz" % number
+
+def listSegments(directory):
+    '''Names of the complete segments of a directory, oldest first.'''
+    if not os.path.isdir(directory):
+        return []
+    return sorted([name for name in os.listdir(directory) if _SEGMENT.match(name)])
+
+class SegmentWriter(object):
+    def __init__(self, directory, maxDocs=10000):
+        self.directory = directory
+        self.maxDocs = maxDocs
+        self.written = 0
+        self.failed = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # number on from every segment, so a new one always sorts last
+        self._number = 0
+        for name in os.listdir(directory):
+            match = _ANY_SEGMENT.match(name)
+            if match:
+                self._number = max(self._number, int(match.group(1)))
+        self._file = None
+        self._path = None
+        self._docs = 0
+
+    def write(self, docs):
+        lines = [json.dumps(doc) + "\n" for doc in docs]
+        try:
+            for line in lines:
+                if self._file is None:
+                    self._open()
+                self._file.write(line)
+                self._docs += 1
+                self.written += 1
+                if self._docs >= self.maxDocs:
+                    self._rotate()
+        except Exception:
+            self._discard()
+            raise
+
+    def _discard(self):
+        self.failed = True
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        os.rename(self._path + ".part", self._path + ".failed")
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._rotate()
+
+    def _open(self):
+        self._number += 1
+        self._path = os.path.join(self.directory, segmentName(self._number))
+        self._file = gzip.open(self._path + ".part", "wb")
+        self._docs = 0
+
+    def _rotate(self):
+        self._file.close()
+        os.rename(self._path + ".part", self._path)
+        self._file = None
+
+def readSegments(directory, offset=None):
+    '''
+    Yields (segment, line, doc) for every document of the complete segments
+    of a directory, line being the number of lines of the segment read
+    including this one. offset is a (segment, line) to carry on after.
+    '''
+    for segment in listSegments(directory):
+        skip = 0
+        if offset is not None:
+            if segment < offset[0]:
+                continue
+            if segment == offset[0]:
+                skip = offset[1]
+        f = gzip.open(os.path.join(directory, segment), "rb")
+        try:
+            line = 0
+            for text in f:
+                line += 1
+                if line <= skip or not text.strip():
+                    continue
+                yield segment, line, json.loads(text)
+        finally:
+            f.close()
+
+class Offset(object):
+    '''How far publishing got, kept in a file rewritten through a rename.'''
+    def __init__(self, path):
+        self.path = path
+        self.value = None
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+            self.value = (data["segment"], data["line"])
+
+    def set(self, segment, line):
+        self.value = (segment, line)
+        tmp = "%s.tmp" % self.path
+        f = open(tmp, "w")
+        try:
+            json.dump({ "segment": segment, "line": line }, f)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
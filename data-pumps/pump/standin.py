@@ -0,0 +1,250 @@
+'''
+A local stand-in for an OAI-PMH repository and a Learning Registry node, to
+develop and benchmark pumps without the live endpoints.
+
+The OAI-PMH side answers ListRecords with synthetic nsdl_dc or oai_dc
+records, pageSize per page with resumption tokens and a completeListSize,
+and honours from. Every set has records of its own. Each page can be
+delayed by latency seconds, and every throttleEvery-th request answered
+with a 503 and a Retry-After. The node side accepts POSTs to /publish and
+answers every document as OK, after publishLatency seconds.
+
+    python -m pump.standin [--port 8000] [--records 10000] ...
+'''
+import cgi
+import datetime
+import json
+import optparse
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+NSDL_DC = '''<record><header><identifier>oai:standin:%(set)s%(i)d</identifier><datestamp>%(datestamp)s</datestamp></header><metadata><nsdl_dc:nsdl_dc xmlns:nsdl_dc="http://ns.nsdl.org/nsdl_dc_v1.02/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dct="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" schemaVersion="1.02.020" xsi:schemaLocation="http://ns.nsdl.org/nsdl_dc_v1.02/ http://ns.nsdl.org/schemas/nsdl_dc/nsdl_dc_v1.02.xsd">
+<dc:identifier xsi:type="dct:URI">http://standin.example.org/resource/%(set)s%(i)d</dc:identifier>
+<dc:title>Resource %(i)d</dc:title>
+<dc:description>%(description)s</dc:description>
+<dc:subject>Mathematics</dc:subject>
+<dc:subject>Subject %(subject)d</dc:subject>
+<dct:educationLevel xsi:type="nsdl_dc:NSDLEdLevel">High School</dct:educationLevel>
+<dc:type xsi:type="dct:DCMIType">Text</dc:type>
+<dc:language>en-us</dc:language>
+<dc:rights>Copyright Stand-in Publisher</dc:rights>
+</nsdl_dc:nsdl_dc></metadata></record>'''
+
+OAI_DC = '''<record><header><identifier>oai:standin:%(set)s%(i)d</identifier><datestamp>%(datestamp)s</datestamp></header><metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier>http://standin.example.org/resource/%(set)s%(i)d</dc:identifier>
+<dc:title>Resource %(i)d</dc:title>
+<dc:description>%(description)s</dc:description>
+<dc:subject>Subject %(subject)d</dc:subject>
+<dc:language>en</dc:language>
+</oai_dc:dc></metadata></record>'''
+
+DELETED = '''<record><header status="deleted"><identifier>oai:standin:%(set)s%(i)d</identifier><datestamp>%(datestamp)s</datestamp></header></record>'''
+
+TEMPLATES = { "nsdl_dc": NSDL_DC, "oai_dc": OAI_DC }
+
+RESPONSE_DATE = "2011-03-14T10:00:00Z"
+
+START = datetime.datetime(2011, 1, 1)
+
+def datestamp(i):
+    '''Records are dated a minute apart from the start of 2011.'''
+    return (START + datetime.timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class Repository(object):
+    '''
+    The synthetic records: records of them, every deletedEvery-th one
+    deleted, with descriptions of descriptionSize characters.
+    '''
+    def __init__(self, records=10000, pageSize=100, deletedEvery=0, descriptionSize=500):
+        self.records = records
+        self.pageSize = pageSize
+        self.deletedEvery = deletedEvery
+        self.descriptionSize = descriptionSize
+
+    def isDeleted(self, i):
+        return self.deletedEvery and i % self.deletedEvery == self.deletedEvery - 1
+
+    def first(self, since):
+        '''Index of the first record dated since or later.'''
+        if not since:
+            return 0
+        lo, hi = 0, self.records
+        while lo < hi:
+            mid = (lo + hi) / 2
+            if datestamp(mid)[:len(since)] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def record(self, prefix, set, i):
+        fields = { "i": i, "set": set and set + "/" or "", "datestamp": datestamp(i), "subject": i % 50,
+                   "description": ("Description of resource %d. " % i * (self.descriptionSize / 20 + 1))[:self.descriptionSize] }
+        if self.isDeleted(i):
+            return DELETED % fields
+        return TEMPLATES[prefix] % fields
+
+    def listRecords(self, params):
+        '''The body of a ListRecords response to params.'''
+        token = params.get("resumptionToken")
+        if token:
+            try:
+                prefix, set, since, start = token.split("|")
+                start = int(start)
+            except ValueError:
+                return error("badResumptionToken", "Unknown resumptionToken")
+        else:
+            prefix = params.get("metadataPrefix")
+            set = params.get("set") or ""
+            since = params.get("from") or ""
+            start = self.first(since)
+        if prefix not in TEMPLATES:
+            return error("cannotDisseminateFormat", "Unknown metadataPrefix %s" % prefix)
+        if start >= self.records:
+            return error("noRecordsMatch", "No records")
+
+        end = min(start + self.pageSize, self.records)
+        records = [self.record(prefix, set, i) for i in range(start, end)]
+        first = self.first(since)
+        size = self.records - first
+        cursor = start - first
+        if end < self.records:
+            next = "%s|%s|%s|%d" % (prefix, set, since, end)
+            records.append('<resumptionToken completeListSize="%d" cursor="%d">%s</resumptionToken>'
+                           % (size, cursor, cgi.escape(next)))
+        elif token:
+            records.append('<resumptionToken completeListSize="%d" cursor="%d"/>' % (size, cursor))
+        return envelope('<ListRecords>%s</ListRecords>' % "".join(records))
+
+def envelope(body):
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<responseDate>%s</responseDate><request verb="ListRecords">http://standin/oai</request>'
+            '%s</OAI-PMH>' % (RESPONSE_DATE, body))
+
+def error(code, message):
+    return envelope('<error code="%s">%s</error>' % (code, cgi.escape(message)))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.oai(urlparse.urlsplit(self.path)[3])
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if urlparse.urlsplit(self.path)[2].rstrip("/").endswith("/publish"):
+            self.publish(data)
+        else:
+            self.oai(data)
+
+    def oai(self, query):
+        server = self.server
+        params = dict(cgi.parse_qsl(query))
+        requests = server.count("requests")
+        if server.throttleEvery and requests % server.throttleEvery == 0:
+            server.count("throttled")
+            self.respond(503, "Slow down", "text/plain", [("Retry-After", str(server.retryAfter))])
+            return
+        if params.get("verb") != "ListRecords":
+            self.respond(200, error("badVerb", "Only ListRecords is served"), "text/xml")
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        body = server.repository.listRecords(params)
+        server.count("pages")
+        server.count("bytesOut", len(body))
+        self.respond(200, body, "text/xml")
+
+    def publish(self, data):
+        server = self.server
+        docs = json.loads(data)["documents"]
+        if server.publishLatency:
+            time.sleep(server.publishLatency)
+        server.count("published", len(docs))
+        server.count("bytesIn", len(data))
+        body = json.dumps({ "OK": True, "document_results": [{ "OK": True } for doc in docs] })
+        self.respond(200, body, "application/json")
+
+    def respond(self, status, body, contentType, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Serves the OAI-PMH repository at any path but /publish, which is the node's.'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, repository, latency=0, throttleEvery=0, retryAfter=1,
+                 publishLatency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.repository = repository
+        self.latency = latency
+        self.throttleEvery = throttleEvery
+        self.retryAfter = retryAfter
+        self.publishLatency = publishLatency
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def count(self, name, n=1):
+        '''Adds n to a stat, returns its new value.'''
+        self._lock.acquire()
+        try:
+            self.stats[name] = self.stats.get(name, 0) + n
+            return self.stats[name]
+        finally:
+            self._lock.release()
+
+    def start(self):
+        '''Serves from a daemon thread.'''
+        thread = threading.Thread(target=self.serve_forever, name="standin")
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+def addOptions(parser):
+    parser.add_option("--records", type="int", default=10000)
+    parser.add_option("--page-size", dest="pageSize", type="int", default=100)
+    parser.add_option("--deleted-every", dest="deletedEvery", type="int", default=0,
+                      help="make every nth record a deleted one")
+    parser.add_option("--description-size", dest="descriptionSize", type="int", default=500)
+    parser.add_option("--latency", type="float", default=0,
+                      help="seconds to wait before answering a page")
+    parser.add_option("--throttle-every", dest="throttleEvery", type="int", default=0,
+                      help="answer every nth OAI-PMH request with a 503")
+    parser.add_option("--retry-after", dest="retryAfter", type="int", default=1)
+    parser.add_option("--publish-latency", dest="publishLatency", type="float", default=0)
+
+def fromOptions(options, address):
+    repository = Repository(options.records, options.pageSize, options.deletedEvery,
+                            options.descriptionSize)
+    return StandinServer(address, repository, options.latency, options.throttleEvery,
+                         options.retryAfter, options.publishLatency)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type="int", default=8000)
+    addOptions(parser)
+    options, args = parser.parse_args()
+    server = fromOptions(options, (options.host, options.port))
+    print("Serving OAI-PMH at %s/oai and /publish" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,46 @@
+'''
+Formats records into envelopes on a pool of worker processes.
+
+Building an envelope parses the record's metadata and serializes its payload,
+which is CPU bound and would otherwise keep a pump on one core however many
+pages are fetched at once. Pages are harvested with serializeRecord as the
+handler, so their records are plain XML strings; these are sent to the
+workers in chunks and come back as ready envelopes.
+'''
+import multiprocessing
+
+from lxml import etree
+
+from pump import oai
+
+def formatChunk(args):
+    '''Envelopes of a chunk of serialized oai:records, run in a worker.'''
+    prefix, xmls = args
+    format = oai.FORMATS[prefix]
+    return [format.formatRecord(etree.fromstring(xml)) for xml in xmls]
+
+class TransformPool(object):
+    '''
+    processes defaults to the number of cores. Create the pool before
+    starting any thread, the workers are forked from the current process.
+    '''
+    def __init__(self, processes=None, chunkSize=50):
+        self.chunkSize = chunkSize
+        self._pool = multiprocessing.Pool(processes)
+
+    def envelopes(self, format, records):
+        '''
+        Envelopes of a list of RawRecords in format, in their order, None for
+        a record without metadata.
+        '''
+        xmls = [record.xml for record in records]
+        chunks = [(format.prefix, xmls[i:i + self.chunkSize])
+                  for i in range(0, len(xmls), self.chunkSize)]
+        docs = []
+        for chunk in self._pool.imap(formatChunk, chunks):
+            docs.extend(chunk)
+        return docs
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
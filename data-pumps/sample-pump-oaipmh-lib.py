@@ -25,7 +25,7 @@ Created on Feb 4, 2011
 import logging
 from oaipmh.metadata import MetadataReader
 
-from restkit.resource import Resource
+from pump.publisher import Publisher
 from nsdl.NSDLDCImport import NSDLDCImport
 import nsdl
 
@@ -35,6 +35,7 @@ if __name__ == '__main__':
     log = logging.getLogger("main")
     reader = MetadataReader(fields = nsdl.LR_NSDL_DC_FIELDS, namespaces = nsdl.LR_NSDL_DC_NAMESPACES)
     myImport = NSDLDCImport(nsdl.ALL_METADATA_URL_NSDL_DC, nsdl.LR_NSDL_PREFIX)
+    publisher = Publisher("http://learningregistry.couchdb:5984")
    
     for (mult, list) in enumerate(myImport.fetch_documents(range=100)):
         # Just print this
@@ -42,12 +43,6 @@ if __name__ == '__main__':
 #            print("%d: %s" % (idx, json.dumps(item)))
             
         #need to post to learning registry
-        try:
-            res = Resource("http://learningregistry.couchdb:5984")
-            body = { "documents":list }
-            log.info("request body: %s" % (json.dumps(body),))
-            clientResponse = res.post(path="/publish", payload=json.dumps(body), headers={"Content-Type":"application/json"})
-            log.info("status: {0}  message: {1}".format(clientResponse.status_int, clientResponse.body_string))
-        except Exception as e:
-            log.exception("Caught Exception")
-        list = myImport.fetch_documents(range=100)
\ No newline at end of file
+        publisher.publish(list)
+    publisher.close()
+    log.info("Published %d documents, %d failed", publisher.published, publisher.failed)
\ No newline at end of file